@@ -2,39 +2,178 @@ import polars as pl
 import pandas as pd
 import yaml
 import requests
+from requests.adapters import HTTPAdapter
 import os
+import atexit
+import shutil
+import tempfile
+import base64
 import hashlib
+import json
 import smtplib
-from io import StringIO
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 
+# ---- HDR binding detection (same bindings as the influxdb3 plugins) ----
+_hdr_cls = None
+_err = None
+try:
+    from hdrhistogram import HdrHistogram as _Hdr
+    _hdr_cls = _Hdr
+except Exception as e1:
+    _err = e1
+    try:
+        from hdrh.histogram import HdrHistogram as _Hdr
+        _hdr_cls = _Hdr
+    except Exception as e2:
+        _err = (e1, e2)
+
 # --- Config ---
 CACHE_DIR = "cached_sources"
 os.makedirs(CACHE_DIR, exist_ok=True)
 source_cache = {}
+DOWNLOAD_CHUNK = 1 << 20
+DOWNLOAD_TIMEOUT = (10, 300)  # connect, read seconds
+session = requests.Session()  # shared connection pool for all downloads
+_scratch = None               # temp dir for sources when use_cache_dir is off
 
 # --- Helpers ---
 
-def get_cache_filename(source_name: str, date_range: dict) -> str:
-    start = date_range.get("start_date", "")
-    end = date_range.get("end_date", "")
-    range_id = f"{start}_{end}"
-    hash_id = hashlib.md5(range_id.encode()).hexdigest()[:8]
-    return os.path.join(CACHE_DIR, f"{source_name}_{hash_id}.parquet")
-
-
-def fetch_csv_from_source(source_name: str, download_sources: dict, auth: dict, date_range: dict, use_cache_dir: bool) -> pl.DataFrame:
-    if source_name in source_cache:
-        return source_cache[source_name]
-
-    parquet_path = get_cache_filename(source_name, date_range)
-
-    if use_cache_dir and os.path.exists(parquet_path):
-        df = pl.read_parquet(parquet_path)
-        source_cache[source_name] = df
-        return df
+class SourceCache:
+    """
+    Parquet copies of downloaded sources in CACHE_DIR, keyed by URL, query
+    params and auth user. index.json keeps each entry's ETag/Last-Modified,
+    size and last use; entries older than max_age_s are revalidated with a
+    conditional GET, and least recently used files are evicted beyond max_mb.
+    """
 
+    def __init__(self, directory: str, max_mb: float = 2048, max_age_s: float = 0):
+        self.directory = directory
+        self.index_path = os.path.join(directory, "index.json")
+        self.max_bytes = int(max_mb * (1 << 20))
+        self.max_age_s = max_age_s
+        self.in_use = set()   # keys read by this run; never evicted
+        self._lock = threading.Lock()
+        try:
+            with open(self.index_path) as f:
+                self.index = json.load(f)
+        except (OSError, ValueError):
+            self.index = {}
+
+    @staticmethod
+    def key(url: str, params: dict, user) -> str:
+        ident = json.dumps([url, sorted(params.items()), user])
+        return hashlib.sha256(ident.encode()).hexdigest()
+
+    def path(self, key: str) -> str:
+        """
+        Where a new entry for key is written. Named by key only, so source
+        names sharing a URL share one file; entries written by older runs
+        under source-named files live at file_of(entry).
+        """
+        return os.path.join(self.directory, f"source_{key[:24]}.parquet")
+
+    def file_of(self, entry: dict) -> str:
+        return os.path.join(self.directory, entry["file"])
+
+    def lookup(self, key: str):
+        """Index entry for key if its file is still present."""
+        with self._lock:
+            entry = self.index.get(key)
+        if entry and os.path.exists(self.file_of(entry)):
+            return entry
+        return None
+
+    def is_fresh(self, entry: dict) -> bool:
+        return time.time() - entry["validated"] < self.max_age_s
+
+    @staticmethod
+    def validators(entry: dict) -> dict:
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def store(self, key: str, path: str, url: str, headers):
+        now = time.time()
+        with self._lock:
+            self.index[key] = {
+                "file": os.path.basename(path), "url": url, "size": os.path.getsize(path),
+                "etag": headers.get("ETag"), "last_modified": headers.get("Last-Modified"),
+                "validated": now, "used": now,
+            }
+            self.in_use.add(key)
+            self._save()
+
+    def touch(self, key: str, revalidated: bool = False):
+        with self._lock:
+            entry = self.index[key]
+            entry["used"] = time.time()
+            if revalidated:
+                entry["validated"] = entry["used"]
+            self.in_use.add(key)
+            self._save()
+
+    def _save(self):
+        tmp = self.index_path + ".part"
+        with open(tmp, "w") as f:
+            json.dump(self.index, f, indent=1)
+        os.replace(tmp, self.index_path)
+
+    def evict(self):
+        """Drop least recently used entries (not used by this run) until under max_mb."""
+        with self._lock:
+            total = sum(e["size"] for e in self.index.values())
+            for key, entry in sorted(self.index.items(), key=lambda kv: kv[1]["used"]):
+                if total <= self.max_bytes:
+                    break
+                if key in self.in_use:
+                    continue
+                try:
+                    os.unlink(self.file_of(entry))
+                except FileNotFoundError:
+                    pass
+                del self.index[key]
+                total -= entry["size"]
+            self._save()
+
+
+def _scratch_dir() -> str:
+    global _scratch
+    if _scratch is None:
+        _scratch = tempfile.mkdtemp(prefix="csv-proc-")
+        atexit.register(shutil.rmtree, _scratch, True)
+    return _scratch
+
+
+def _download_to_parquet(response, parquet_path: str):
+    """
+    Stream the body to disk, then convert CSV -> Parquet with the streaming
+    engine; neither step holds the whole source in memory. The Parquet file
+    appears atomically.
+    """
+    csv_path = parquet_path + ".csv.part"
+    tmp_path = parquet_path + ".part"
+    try:
+        with open(csv_path, "wb") as f:
+            for block in response.iter_content(chunk_size=DOWNLOAD_CHUNK):
+                f.write(block)
+        pl.scan_csv(csv_path).sink_parquet(tmp_path)
+        os.replace(tmp_path, parquet_path)
+    finally:
+        for path in (csv_path, tmp_path):
+            if os.path.exists(path):
+                os.unlink(path)
+
+
+def source_request(source_name: str, download_sources: dict, auth: dict, date_range: dict):
+    """(url, query params, auth tuple or None, cache key) for downloading a source."""
     url = download_sources.get(source_name)
     if not url:
         raise ValueError(f"No download URL found for source: {source_name}")
@@ -48,17 +187,384 @@ def fetch_csv_from_source(source_name: str, download_sources: dict, auth: dict,
         "end_date": date_range.get("end_date")
     }
     params = {k: v for k, v in params.items() if v is not None}
+    return url, params, auth_tuple, SourceCache.key(url, params, user)
 
-    response = requests.get(url, auth=auth_tuple, params=params)
-    response.raise_for_status()
 
-    df = pl.read_csv(StringIO(response.text))
+def fetch_csv_from_source(source_name: str, download_sources: dict, auth: dict, date_range: dict, cache) -> pl.LazyFrame:
+    """
+    Lazy scan of a source. Sources are scanned from Parquet, so each
+    section's query reads only the columns it uses and pushes filters down.
+    cache is a SourceCache, or None to download into a temp dir every run.
+    """
+    url, params, auth_tuple, key = source_request(source_name, download_sources, auth, date_range)
+    if key in source_cache:
+        return source_cache[key]
+
+    if cache is None:
+        parquet_path = os.path.join(_scratch_dir(), f"source_{key[:24]}.parquet")
+        entry = None
+    else:
+        # the key ignores the source name: an entry stored under another name is reused as is
+        entry = cache.lookup(key)
+        parquet_path = cache.file_of(entry) if entry is not None else cache.path(key)
+        if entry is not None and cache.is_fresh(entry):
+            cache.touch(key)
+            lf = source_cache[key] = pl.scan_parquet(parquet_path)
+            return lf
+
+    headers = SourceCache.validators(entry) if entry is not None else {}
+    try:
+        with session.get(url, auth=auth_tuple, params=params, headers=headers, stream=True,
+                         timeout=DOWNLOAD_TIMEOUT) as response:
+            if entry is not None and response.status_code == 304:
+                cache.touch(key, revalidated=True)
+            else:
+                response.raise_for_status()
+                _download_to_parquet(response, parquet_path)
+                if cache is not None:
+                    cache.store(key, parquet_path, url, response.headers)
+    except requests.RequestException as e:
+        if entry is None:
+            raise
+        print(f"Revalidating {source_name} failed ({e}); using cached copy")
+        cache.touch(key)
+
+    lf = source_cache[key] = pl.scan_parquet(parquet_path)
+    return lf
+
+
+def prefetch_sources(fetches, download_sources: dict, auth: dict, cache, max_workers: int = 4):
+    """Fetch every distinct download up front, at most max_workers downloads at a time."""
+    # one task per cache key: source names sharing a URL/range would otherwise race on one file
+    fetches = list({source_request(name, download_sources, auth, rng)[3]: (name, rng)
+                    for name, rng in fetches}.values())
+    adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [
+            pool.submit(fetch_csv_from_source, name, download_sources, auth, source_range, cache)
+            for name, source_range in fetches
+        ]
+        for future in futures:
+            future.result()
+    if cache is not None:
+        cache.evict()
+
+
+def build_section_mask(section_name: str, section_data: dict, filter_rows: list):
+    """
+    (speed column, filter mask or None) for a section, both in terms of the
+    source's original column names (the section's rename map is inverted
+    rather than applied), so sections sharing a source share one scan.
+    """
+    rename_map = section_data.get("rename", {})
+    filters = section_data.get("filters", {})
+    original = {new: old for old, new in rename_map.items()}
 
-    if use_cache_dir:
-        df.write_parquet(parquet_path)
+    conditions = []
+    for column, filter_def in filters.items():
+        if isinstance(filter_def, dict):
+            filter_type = filter_def.get("type", "exact")
+            filter_value = filter_def.get("value")
+        else:
+            filter_type = "exact"
+            filter_value = filter_def
 
-    source_cache[source_name] = df
-    return df
+        # Record filter info for email
+        filter_rows.append({
+            "Source": section_name,
+            "Column": column,
+            "Type": filter_type,
+            "Value": str(filter_value)
+        })
+
+        # Build filter condition
+        col = pl.col(original.get(column, column))
+        if filter_type == "exact":
+            if not isinstance(filter_value, list):
+                filter_value = [filter_value]
+            conditions.append(col.is_in(filter_value))
+        elif filter_type == "regex":
+            conditions.append(col.str.contains(filter_value))
+        else:
+            raise ValueError(f"Unknown filter type: {filter_type}")
+
+    combined_filter = None
+    for cond in conditions:
+        combined_filter = cond if combined_filter is None else combined_filter & cond
+    return original.get("speed", "speed"), combined_filter
+
+
+def section_stat_exprs(speed_col: str, mask, percentiles, prefix: str = "") -> list:
+    """Quantile/min/max expressions for one section, over rows where mask holds."""
+    speed = pl.col(speed_col)
+    if mask is not None:
+        speed = speed.filter(mask)
+    return [
+        speed.quantile(p, "nearest").alias(f"{prefix}p{int(p*100)}")
+        for p in percentiles
+    ] + [
+        speed.min().alias(f"{prefix}min"),
+        speed.max().alias(f"{prefix}max")
+    ]
+
+
+def timestamp_expr(lf: pl.LazyFrame, ts_col: str, ts_format=None) -> pl.Expr:
+    """ts_col as a Datetime expression; CSV strings are parsed with ts_format (inferred if None)."""
+    ts = pl.col(ts_col)
+    if lf.collect_schema()[ts_col] == pl.String:
+        return ts.str.to_datetime(ts_format, strict=False)
+    return ts.cast(pl.Datetime)
+
+
+def bucket_reports(lf: pl.LazyFrame, sections: list, percentiles, ts_col: str, every: str,
+                   ts_format=None) -> dict:
+    """
+    Percentiles per `every` time bucket for several sections of one source,
+    [(section_name, speed column, mask)], from a single group_by_dynamic
+    pass. Returns section -> DataFrame(bucket, p.., min, max, count) holding
+    only the buckets where the section has rows.
+    """
+    exprs = []
+    for idx, (_name, speed_col, mask) in enumerate(sections):
+        prefix = f"{idx}:"
+        speed = pl.col(speed_col) if mask is None else pl.col(speed_col).filter(mask)
+        exprs += section_stat_exprs(speed_col, mask, percentiles, prefix)
+        exprs.append(speed.count().alias(f"{prefix}count"))
+
+    wide = (
+        lf.with_columns(timestamp_expr(lf, ts_col, ts_format).alias("bucket"))
+        .drop_nulls("bucket")
+        .sort("bucket")
+        .group_by_dynamic("bucket", every=every)
+        .agg(exprs)
+        .collect(engine="streaming")
+    )
+
+    out = {}
+    for idx, (section_name, _speed_col, _mask) in enumerate(sections):
+        prefix = f"{idx}:"
+        cols = [c for c in wide.columns if c.startswith(prefix)]
+        out[section_name] = wide.select(
+            [pl.col("bucket")] + [pl.col(c).alias(c[len(prefix):]) for c in cols]
+        ).filter(pl.col("count") > 0)
+    return out
+
+
+def write_bucket_reports(reports: dict, directory: str) -> None:
+    """
+    Bucketed reports as Parquet partitioned by section and day
+    (directory/section=<name>/date=<YYYY-MM-DD>/), replacing earlier runs'
+    files for the same partitions.
+    """
+    frames = [
+        df.with_columns(pl.lit(section_name).alias("section"), pl.col("bucket").dt.date().alias("date"))
+        for section_name, df in reports.items() if df.height
+    ]
+    if not frames:
+        return
+    pl.concat(frames).write_parquet(directory, partition_by=["section", "date"], mkdir=True)
+
+
+class Sketch:
+    """
+    An HDR histogram plus the exact min/max of the speeds it recorded; the
+    histogram's own min/max are only as precise as its buckets.
+    """
+
+    __slots__ = ("hist", "min", "max")
+
+    def __init__(self, hist, lo=None, hi=None):
+        self.hist = hist
+        self.min = lo
+        self.max = hi
+
+
+class SketchStore:
+    """
+    Daily sketches of a section's speed values, one file per
+    (source URL, section definition, day) under CACHE_DIR/sketches, stored as
+    JSON holding base64 of the histogram's encode() (like latency_5m's
+    histo_b64) and the exact min/max.
+    Only complete past days are stored; partial days are recomputed.
+    Values are recorded as round(speed * scale), so scale sets the resolution
+    (e.g. 1000 keeps three decimals); highest is in scaled units.
+    """
+
+    def __init__(self, directory: str, highest: int = 10**12, sigfigs: int = 3, scale: float = 1):
+        if _hdr_cls is None:
+            raise RuntimeError(f"HDRHistogram not found (pip install hdrhistogram). Import errors: {_err}")
+        self.directory = directory
+        self.highest = highest
+        self.sigfigs = sigfigs
+        self.scale = scale
+        os.makedirs(directory, exist_ok=True)
+
+    def new(self) -> Sketch:
+        return Sketch(_hdr_cls(1, self.highest, self.sigfigs))
+
+    def section_id(self, url: str, section_data: dict, ts_col: str) -> str:
+        # scale is part of the id: sketches recorded at another resolution are not reused
+        ident = json.dumps([url, section_data.get("rename", {}), section_data.get("filters", {}), ts_col,
+                            self.scale], sort_keys=True, default=str)
+        return hashlib.sha256(ident.encode()).hexdigest()[:24]
+
+    def _path(self, section_id: str, day: date) -> str:
+        # .json, not the earlier .b64: sketches stored without min/max are recomputed
+        return os.path.join(self.directory, section_id, f"{day.isoformat()}.json")
+
+    def get(self, section_id: str, day: date):
+        try:
+            with open(self._path(section_id, day)) as f:
+                stored = json.load(f)
+        except FileNotFoundError:
+            return None
+        raw = base64.b64decode(stored["hist"])
+        h = _hdr_cls.decode(raw) if hasattr(_hdr_cls, "decode") else _hdr_cls.from_byte_array(raw)
+        return Sketch(h, stored["min"], stored["max"])
+
+    def put(self, section_id: str, day: date, sketch: Sketch):
+        path = self._path(section_id, day)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        h = sketch.hist
+        raw = h.encode() if hasattr(h, "encode") else h.to_byte_array()
+        tmp = path + ".part"
+        with open(tmp, "w") as f:
+            json.dump({"hist": base64.b64encode(raw).decode(), "min": sketch.min, "max": sketch.max}, f)
+        os.replace(tmp, path)
+
+
+def _merge(target: Sketch, src: Sketch) -> Sketch:
+    if src.hist.total_count == 0:
+        return target   # an empty histogram would drag min to 0
+    if hasattr(target.hist, "add"):
+        target.hist.add(src.hist)
+    else:
+        target.hist.merge(src.hist)
+    if src.min is not None:
+        target.min = src.min if target.min is None else min(target.min, src.min)
+        target.max = src.max if target.max is None else max(target.max, src.max)
+    return target
+
+
+def _parse_bound(value: str) -> datetime:
+    return datetime.fromisoformat(value)
+
+
+def _format_bound(value: datetime) -> str:
+    return value.strftime("%Y-%m-%dT%H:%M")
+
+
+def sketch_plan(plans: dict, full_config: dict, store: SketchStore, download_sources: dict, date_range: dict,
+                ts_col: str):
+    """
+    Load cached daily sketches and work out, per source, which days still
+    have to be computed and the narrowed date_range to download for them.
+    Returns (hists, todo, source_ranges, complete):
+      hists:         section -> {day: Sketch} (cached days)
+      todo:          source -> sorted days to compute
+      source_ranges: source -> [date_range per run of consecutive days to compute]
+      complete:      day -> whether its sketch may be stored
+    """
+    start = _parse_bound(date_range["start_date"])
+    end = _parse_bound(date_range["end_date"])
+    now = datetime.now()
+    days = [start.date() + timedelta(days=i) for i in range((end.date() - start.date()).days + 1)]
+
+    def complete(day):
+        day_start = datetime.combine(day, datetime.min.time())
+        day_end = day_start + timedelta(days=1)
+        return start <= day_start and day_end <= end and day_end <= now
+
+    hists, todo, source_ranges = {}, {}, {}
+    for source_name, sections in plans.items():
+        url = download_sources.get(source_name, source_name)
+        missing = set()
+        for section_name, _speed_col, _mask in sections:
+            sid = store.section_id(url, full_config[section_name], ts_col)
+            hists[section_name] = {}
+            for day in days:
+                h = store.get(sid, day) if complete(day) else None
+                if h is None:
+                    missing.add(day)
+                else:
+                    hists[section_name][day] = h
+        if missing:
+            todo[source_name] = sorted(missing)
+            runs = []
+            for day in todo[source_name]:
+                if runs and runs[-1][1] + timedelta(days=1) == day:
+                    runs[-1][1] = day
+                else:
+                    runs.append([day, day])
+            source_ranges[source_name] = []
+            for first_day, last_day in runs:
+                first = datetime.combine(first_day, datetime.min.time())
+                last = datetime.combine(last_day, datetime.min.time()) + timedelta(days=1)
+                source_ranges[source_name].append({
+                    "start_date": date_range["start_date"] if first <= start else _format_bound(first),
+                    "end_date": date_range["end_date"] if last >= end else _format_bound(last),
+                })
+    return hists, todo, source_ranges, complete
+
+
+def sketch_days(parts: list, sections: list, days: list, store: SketchStore, date_range: dict,
+                ts_col: str, ts_format=None) -> dict:
+    """
+    One scan of a source's downloaded parts, [(LazyFrame, date_range)], for
+    the given days: returns section -> {day: Sketch}. Each part is held to
+    its own range so overlapping downloads never count a row twice; the scan
+    projects only the timestamp, speed and filter columns.
+    """
+    start = _parse_bound(date_range["start_date"])
+    end = _parse_bound(date_range["end_date"])
+
+    frames = []
+    for lf, rng in parts:
+        ts = timestamp_expr(lf, ts_col, ts_format)
+        part_start = max(start, _parse_bound(rng["start_date"]))
+        part_end = min(end, _parse_bound(rng["end_date"]))
+        exprs = [ts.dt.date().alias("_day")]
+        for idx, (_name, speed_col, mask) in enumerate(sections):
+            exprs.append((pl.col(speed_col) * store.scale).round().cast(pl.Int64).alias(f"_v{idx}"))
+            exprs.append(pl.col(speed_col).cast(pl.Float64).alias(f"_r{idx}"))
+            exprs.append((mask if mask is not None else pl.lit(True)).alias(f"_m{idx}"))
+        frames.append(
+            lf.filter(ts.is_between(pl.lit(part_start), pl.lit(part_end), closed="left" if part_end < end else "both")
+                      & ts.dt.date().is_in(days))
+            .select(exprs)
+        )
+    narrow = pl.concat(frames).collect(engine="streaming")
+
+    out = {}
+    for idx, (section_name, _speed_col, _mask) in enumerate(sections):
+        per_day = {day: store.new() for day in days}
+        rows = narrow.filter(pl.col(f"_m{idx}") & pl.col(f"_v{idx}").is_not_null())
+        for day, value, n in rows.group_by(["_day", f"_v{idx}"]).len().iter_rows():
+            try:
+                per_day[day].hist.record_value(value, n)
+            except Exception:
+                pass  # outside the histogram's range
+        bounds = rows.group_by("_day").agg(pl.col(f"_r{idx}").min().alias("lo"), pl.col(f"_r{idx}").max().alias("hi"))
+        for day, lo, hi in bounds.iter_rows():
+            per_day[day].min, per_day[day].max = lo, hi
+        out[section_name] = per_day
+    return out
+
+
+def sketch_stats(name: str, sketch: Sketch, percentiles, scale: float = 1) -> pl.DataFrame:
+    """
+    One report row from a (merged) sketch recorded at SketchStore.scale:
+    percentiles come from the histogram, min/max are exact.
+    """
+    h = sketch.hist
+    empty = h.total_count == 0
+    row = {f"p{int(p*100)}": [None if empty else h.get_value_at_percentile(p * 100) / scale] for p in percentiles}
+    row["min"] = [None if empty else sketch.min]
+    row["max"] = [None if empty else sketch.max]
+    row["source"] = [name]
+    return pl.DataFrame(row, schema_overrides={c: pl.Float64 for c in row if c != "source"})
 
 
 def send_email_report(subject, sender, to_list, cc_list, df_out, smtp_config, filter_df):
@@ -100,9 +606,16 @@ sum_percentiles = full_config.pop("sum_percentiles", False)
 exclude_from_sum = set(full_config.pop("exclude_from_sum", []))
 row_order = full_config.pop("row_order", None)
 use_cache_dir = full_config.pop("use_cache_dir", True)
+cache_max_mb = full_config.pop("cache_max_mb", 2048)
+cache_max_age = full_config.pop("cache_max_age", 0)
 auth = full_config.pop("auth", {})
 date_range = full_config.pop("date_range", {})
 download_sources = full_config.pop("download_sources", {})
+download_concurrency = full_config.pop("download_concurrency", 4)
+sketch_config = full_config.pop("sketches", None) or {}
+if not sketch_config.get("enabled", True):
+    sketch_config = {}
+bucket_dir = full_config.pop("bucket_dir", "buckets")
 
 # Email settings
 email_config = full_config.pop("email", {})
@@ -116,62 +629,99 @@ results = []
 included_for_sum = []
 filter_rows = []
 
-# --- Process Sections ---
-for section_name, section_data in full_config.items():
-    source_name = section_data["source"]
-    rename_map = section_data.get("rename", {})
-    filters = section_data.get("filters", {})
-
-    df = fetch_csv_from_source(source_name, download_sources, auth, date_range, use_cache_dir)
-
-    if rename_map:
-        df = df.rename(rename_map)
-
-    conditions = []
-    for column, filter_def in filters.items():
-        if isinstance(filter_def, dict):
-            filter_type = filter_def.get("type", "exact")
-            filter_value = filter_def.get("value")
-        else:
-            filter_type = "exact"
-            filter_value = filter_def
-
-        # Record filter info for email
-        filter_rows.append({
-            "Source": section_name,
-            "Column": column,
-            "Type": filter_type,
-            "Value": str(filter_value)
-        })
-
-        # Build filter condition
-        if filter_type == "exact":
-            if not isinstance(filter_value, list):
-                filter_value = [filter_value]
-            conditions.append(pl.col(column).is_in(filter_value))
-        elif filter_type == "regex":
-            conditions.append(pl.col(column).str.contains(filter_value))
-        else:
-            raise ValueError(f"Unknown filter type: {filter_type}")
-
-    if conditions:
-        combined_filter = conditions[0]
-        for cond in conditions[1:]:
-            combined_filter &= cond
-        df = df.filter(combined_filter)
-
-    stat_exprs = [
-        pl.col("speed").quantile(p, "nearest").alias(f"p{int(p*100)}")
-        for p in default_percentiles
-    ] + [
-        pl.col("speed").min().alias("min"),
-        pl.col("speed").max().alias("max")
-    ]
-
-    stats = df.select(stat_exprs).with_columns(
-        pl.lit(section_name).alias("source")
-    )
+cache = SourceCache(CACHE_DIR, cache_max_mb, cache_max_age) if use_cache_dir else None
 
+# Sections are grouped by source: every section of a source is one mask
+# over the source's original columns, and all their quantiles/min/max come
+# from a single aggregation pass over that source.
+plans = {}  # source -> [(section_name, speed column, mask)]
+bucket_plans = {}  # (source, timestamp column, format, every) -> [(section_name, speed column, mask)]
+for section_name, section_data in full_config.items():
+    speed_col, mask = build_section_mask(section_name, section_data, filter_rows)
+    plans.setdefault(section_data["source"], []).append((section_name, speed_col, mask))
+
+    # "bucket: 5m" or {every, timestamp_column, timestamp_format}; columns use the section's names
+    bucket = section_data.get("bucket")
+    if bucket:
+        if not isinstance(bucket, dict):
+            bucket = {"every": bucket}
+        original = {new: old for old, new in section_data.get("rename", {}).items()}
+        ts_col = bucket.get("timestamp_column", "timestamp")
+        key = (section_data["source"], original.get(ts_col, ts_col), bucket.get("timestamp_format"), bucket["every"])
+        bucket_plans.setdefault(key, []).append((section_name, speed_col, mask))
+
+section_stats = {}
+pooled = None
+if sketch_config:
+    # --- Daily sketches: only days without a cached sketch are downloaded and scanned ---
+    ts_col = sketch_config.get("timestamp_column", "timestamp")
+    store = SketchStore(os.path.join(CACHE_DIR, "sketches"),
+                        sketch_config.get("highest", 10**12), sketch_config.get("sigfigs", 3),
+                        sketch_config.get("scale", 1))
+    hists, todo, source_ranges, is_complete = sketch_plan(plans, full_config, store, download_sources,
+                                                             date_range, ts_col)
+    # bucketed reports need every row in the range, so their sources are fetched whole
+    prefetch_sources([(name, rng) for name, ranges in source_ranges.items() for rng in ranges]
+                     + [(name, date_range) for name in {key[0] for key in bucket_plans}],
+                     download_sources, auth, cache, download_concurrency)
+
+    for source_name, days in todo.items():
+        sections = plans[source_name]
+        parts = [
+            (fetch_csv_from_source(source_name, download_sources, auth, rng, cache), rng)
+            for rng in source_ranges[source_name]
+        ]
+        computed = sketch_days(parts, sections, days, store, date_range, ts_col, sketch_config.get("timestamp_format"))
+        url = download_sources.get(source_name, source_name)
+        for section_name, per_day in computed.items():
+            sid = store.section_id(url, full_config[section_name], ts_col)
+            for day, h in per_day.items():
+                if day in hists[section_name]:
+                    continue
+                hists[section_name][day] = h
+                if is_complete(day):
+                    store.put(sid, day, h)
+
+    for section_name in full_config:
+        merged = store.new()
+        for h in hists[section_name].values():
+            _merge(merged, h)
+        section_stats[section_name] = sketch_stats(section_name, merged, default_percentiles, store.scale)
+        if section_name not in exclude_from_sum:
+            pooled = _merge(pooled if pooled is not None else store.new(), merged)
+else:
+    # --- Download all referenced sources concurrently ---
+    prefetch_sources([(source_name, date_range) for source_name in plans],
+                     download_sources, auth, cache, download_concurrency)
+
+    # --- Process Sections ---
+    for source_name, sections in plans.items():
+        lf = fetch_csv_from_source(source_name, download_sources, auth, date_range, cache)
+
+        # the streaming engine keeps sources larger than memory from being materialized
+        wide = lf.select([
+            expr
+            for idx, (_name, speed_col, mask) in enumerate(sections)
+            for expr in section_stat_exprs(speed_col, mask, default_percentiles, f"{idx}:")
+        ]).collect(engine="streaming")
+
+        for idx, (section_name, _speed_col, _mask) in enumerate(sections):
+            prefix = f"{idx}:"
+            cols = [c for c in wide.columns if c.startswith(prefix)]
+            section_stats[section_name] = wide.select(
+                [pl.col(c).alias(c[len(prefix):]) for c in cols]
+            ).with_columns(pl.lit(section_name).alias("source"))
+
+# --- Time-bucketed reports: one group_by_dynamic pass per (source, timestamp, bucket size) ---
+bucket_results = {}
+for (source_name, ts_col, ts_format, every), sections in bucket_plans.items():
+    lf = fetch_csv_from_source(source_name, download_sources, auth, date_range, cache)
+    bucket_results.update(bucket_reports(lf, sections, default_percentiles, ts_col, every, ts_format))
+if bucket_results:
+    write_bucket_reports(bucket_results, bucket_dir)
+
+for section_name in full_config:
+    stats = section_stats[section_name]
     results.append(stats)
 
     if section_name not in exclude_from_sum:
@@ -186,6 +736,10 @@ if sum_percentiles and included_for_sum:
     )
     final_df = pl.concat([final_df, summed])
 
+if pooled is not None:
+    # true pooled percentiles over every summed section's rows (merged sketches)
+    final_df = pl.concat([final_df, sketch_stats("ALL", pooled, default_percentiles, store.scale)], how="vertical_relaxed")
+
 df_out = final_df.to_pandas().set_index("source")
 filter_df = pd.DataFrame(filter_rows)
 
@@ -208,3 +762,6 @@ else:
     print(df_out)
     print("\n--- Filters Used ---")
     print(filter_df)
+
+if bucket_results:
+    print(f"\nBucketed reports for {', '.join(bucket_results)} written to {bucket_dir}/")
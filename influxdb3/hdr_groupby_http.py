@@ -12,13 +12,22 @@
 #   "min_count": 0,                          # optional; filter out tiny groups
 #   "order_by": "p99",                       # optional; sort groups by a field
 #   "order_dir": "desc",                     # optional; asc|desc
-#   "limit": 100                             # optional; limit number of groups returned
+#   "limit": 100,                            # optional; limit number of groups returned
+#   "corrected": false,                      # optional; merge the CO-corrected histo_co_b64 instead
+#   "exact": true,                           # optional; fill unaligned edges from raw streaming2
+#   "expected_interval_ns": 0                # with corrected+exact: sender period for CO-correcting edges;
+#                                            #   omitted -> exact is off (whole 5m rows)
 # }
+#
+# latency_5m rows are stamped at the END of their 5m window. With "exact" (default),
+# the aligned interior [ceil5m(start), floor5m(end)) is served from latency_5m and the
+# partial leading/trailing intervals are built on the fly from raw streaming2 rows.
 
 from typing import Dict, Any, List, Tuple, DefaultDict
-from collections import defaultdict
+from collections import defaultdict, Counter
 import json
 import base64
+from datetime import datetime, timezone, timedelta
 
 # Try common HDR bindings
 _hdr_cls = None
@@ -41,6 +50,8 @@ HIGHEST = 30_000_000_000   # 30s in ns
 UNIT    = "ns"
 
 DEFAULT_PCTS = [50.0, 90.0, 95.0, 99.0, 99.9]
+BUCKET = timedelta(minutes=5)
+RAW_TABLE = "streaming2"
 
 def _require_hdr():
     if _hdr_cls is None:
@@ -89,6 +100,41 @@ def _parse_pcts(spec: str) -> List[float]:
             pass
     return out or DEFAULT_PCTS
 
+def _parse_iso(ts: str) -> datetime:
+    dt = datetime.fromisoformat(str(ts).strip().replace("Z", "+00:00"))
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+def _iso_utc(dt: datetime) -> str:
+    return dt.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+def _floor_5m(dt: datetime) -> datetime:
+    dt = dt.replace(second=0, microsecond=0)
+    return dt - timedelta(minutes=dt.minute % 5)
+
+def _ceil_5m(dt: datetime) -> datetime:
+    f = _floor_5m(dt)
+    return f if f == dt else f + BUCKET
+
+def _filters_sql(filters: Dict[str, List[str]]) -> List[str]:
+    out: List[str] = []
+    for tag, vals in filters.items():
+        if not isinstance(vals, list) or not vals:
+            continue
+        quoted = ",".join(f"'{str(v)}'" for v in vals)
+        out.append(f"\"{tag}\" IN ({quoted})")
+    return out
+
+def _raw_columns(influxdb3_local) -> set:
+    """Column names of RAW_TABLE (edges can only group/filter on these)."""
+    rows = influxdb3_local.query(
+        f"SELECT column_name FROM information_schema.columns WHERE table_name = '{RAW_TABLE}'", {}
+    ) or []
+    return {r.get("column_name") for r in rows}
+
+def _group_key(r: Dict[str, Any], group_tags: List[str]) -> Tuple[Tuple[str, str], ...]:
+    # Build the group key in the ORDER the user requested
+    return tuple((t, "" if r.get(t) is None else str(r.get(t))) for t in group_tags)
+
 def _ok(influxdb3_local):
     # tiny query to prove SQL path is working
     try:
@@ -144,33 +190,114 @@ def process_request(influxdb3_local, query_parameters, request_headers, request_
     order_by  = body.get("order_by") or None   # e.g., "p99" or "count"
     order_dir = (body.get("order_dir") or "desc").lower()
     limit     = int(body.get("limit", 0) or 0)
+    corrected = bool(body.get("corrected", False))
+
+    # Raw vs coordinated-omission-corrected columns (see hdrhistogram.py expected_interval_ns)
+    hist_col  = "histo_co_b64" if corrected else "histo_b64"
+    max_col   = "co_max"       if corrected else "max"
+    count_col = "co_count"     if corrected else "count"
+
+    exact     = bool(body.get("exact", True))
+    try:
+        expected_interval_ns = int(body.get("expected_interval_ns", 0) or 0)
+    except (TypeError, ValueError):
+        expected_interval_ns = 0
+    # Raw edges cannot be CO-corrected without the sender period: fall back
+    # to whole 5m rows rather than silently dropping the edges
+    if exact and corrected and not expected_interval_ns:
+        exact = False
+
+    # Split [start, end) into raw edges + aligned 5m interior
+    edges: List[Tuple[datetime, datetime]] = []
+    if exact:
+        try:
+            start_dt, end_dt = _parse_iso(start), _parse_iso(end)
+        except ValueError:
+            return {"error": "start/end must be ISO-8601 timestamps", "window": {"start": start, "end": end}}
+        lo, hi = _ceil_5m(start_dt), _floor_5m(end_dt)
+        if lo >= hi:
+            # no full aligned 5m bucket inside the window: serve it all from raw
+            edges.append((start_dt, end_dt))
+            lo = hi = None
+        else:
+            if start_dt < lo:
+                edges.append((start_dt, lo))
+            if hi < end_dt:
+                edges.append((hi, end_dt))
+
+    # Raw edge samples, grouped the same way as the 5m rows. Edges come first:
+    # if they cannot be served (a group/filter tag that only exists on
+    # latency_5m, e.g. the downsampler's extra_tags, or a failing query) the
+    # window falls back to whole 5m rows and is reported as not exact.
+    edge_samples: DefaultDict[Tuple[Tuple[str, str], ...], List[int]] = defaultdict(list)
+    edge_status = "none"
+    if edges:
+        raw_rows = None
+        try:
+            missing = (set(group_tags) | set(filters)) - _raw_columns(influxdb3_local)
+        except Exception as e:
+            missing = None
+            edge_status = f"error: {e}"
+        if missing:
+            edge_status = f"unavailable: {RAW_TABLE} has no column(s) {', '.join(sorted(missing))}"
+        elif missing is not None:
+            raw_cols = ["\"latency\""] + [f"\"{t}\"" for t in group_tags]
+            ranges = " OR ".join(
+                f"(\"time\" >= TIMESTAMP '{_iso_utc(a)}' AND \"time\" < TIMESTAMP '{_iso_utc(b)}')"
+                for a, b in edges
+            )
+            raw_where = " AND ".join([f"({ranges})"] + _filters_sql(filters))
+            try:
+                raw_rows = influxdb3_local.query(
+                    f"SELECT {', '.join(raw_cols)} FROM {RAW_TABLE} WHERE {raw_where}", {}
+                ) or []
+                edge_status = "ok"
+            except Exception as e:
+                edge_status = f"error: {e}"
+        if raw_rows is None:
+            exact = False
+        for r in raw_rows or []:
+            v = r.get("latency")
+            if v is None:
+                continue
+            try:
+                x = int(v)
+            except Exception:
+                continue
+            if x >= 0:
+                edge_samples[_group_key(r, group_tags)].append(x)
 
     # Build WHERE clause from time + filters
-    where = [f"\"time\" >= TIMESTAMP '{start}'", f"\"time\" < TIMESTAMP '{end}'"]
-    for tag, vals in filters.items():
-        if not isinstance(vals, list) or not vals:
-            continue
-        quoted = ",".join(f"'{str(v)}'" for v in vals)
-        where.append(f"\"{tag}\" IN ({quoted})")
-    where_sql = " AND ".join(where)
+    if not exact:
+        where = [f"\"time\" >= TIMESTAMP '{start}'", f"\"time\" < TIMESTAMP '{end}'"]
+    elif lo is not None:
+        # rows stamped at window end: (lo, hi] covers [lo, hi)
+        where = [f"\"time\" > TIMESTAMP '{_iso_utc(lo)}'", f"\"time\" <= TIMESTAMP '{_iso_utc(hi)}'"]
+    else:
+        where = None
+    if where is not None:
+        where_sql = " AND ".join(where + _filters_sql(filters))
 
     # Pull only what we need from latency_5m
     # We need tags that might be used in group_by, plus min/max/count and histo_b64
-    select_cols = ["\"histo_b64\"", "\"min\"", "\"max\"", "\"count\""]
+    select_cols = [f"\"{hist_col}\"", "\"min\"", f"\"{max_col}\"", f"\"{count_col}\""]
     # Include all potential tag columns we could group by (safe to include extra)
     # Add the tags you use in latency_5m:
     possible_tags = ["component", "session", "channel", "source", "env", "region"]
     for t in possible_tags:
         select_cols.append(f"\"{t}\"")
-    q = f"""
-      SELECT {", ".join(select_cols)}
-      FROM latency_5m
-      WHERE {where_sql}
-    """
-
-    rows = influxdb3_local.query(q, {}) or []
-    if not rows:
-        return {"groups": [], "total_groups": 0, "window": {"start": start, "end": end}}
+    rows: List[Dict[str, Any]] = []
+    if where is not None:
+        q = f"""
+          SELECT {", ".join(select_cols)}
+          FROM latency_5m
+          WHERE {where_sql}
+        """
+        rows = influxdb3_local.query(q, {}) or []
+
+    window = {"start": start, "end": end, "exact": exact, "edges": edge_status}
+    if not rows and not edge_samples:
+        return {"groups": [], "total_groups": 0, "window": window}
 
     # Bucket key is ORDERED by requested group_tags, so ("channel","source") != ("source","channel") in output
     buckets: DefaultDict[Tuple[Tuple[str,str], ...], Dict[str, Any]] = defaultdict(lambda: {
@@ -181,17 +308,11 @@ def process_request(influxdb3_local, query_parameters, request_headers, request_
 
     # Merge rows into buckets
     for r in rows:
-        hb64 = r.get("histo_b64")
+        hb64 = r.get(hist_col)
         if not hb64:
             continue
 
-        # Build the group key in the ORDER the user requested
-        key_pairs: List[Tuple[str,str]] = []
-        for t in group_tags:
-            v = r.get(t)
-            key_pairs.append((t, "" if v is None else str(v)))
-        key = tuple(key_pairs)
-
+        key = _group_key(r, group_tags)
         b = buckets[key]
         try:
             h = _decode_hdr(hb64)
@@ -201,13 +322,35 @@ def process_request(influxdb3_local, query_parameters, request_headers, request_
             continue
 
         # Aggregate min/max/count
-        vmin, vmax, cnt = r.get("min"), r.get("max"), r.get("count")
+        vmin, vmax, cnt = r.get("min"), r.get(max_col), r.get(count_col)
         if vmin is not None: b["min"] = vmin if b["min"] is None else min(b["min"], vmin)
         if vmax is not None: b["max"] = vmax if b["max"] is None else max(b["max"], vmax)
         if cnt  is not None: b["count"] = b["count"] + int(cnt)
 
         # Save tag values for output
-        for t, val in key_pairs:
+        for t, val in key:
+            b["tags"][t] = val
+
+    # Merge raw edge samples: one histogram per group, one record per distinct value
+    for key, samples in edge_samples.items():
+        h = _new_hdr()
+        for x, n in Counter(samples).items():
+            try:
+                if corrected:
+                    h.record_corrected_value(x, expected_interval_ns, n)
+                else:
+                    h.record_value(x, n)
+            except Exception:
+                pass
+        if h.total_count == 0:
+            continue
+        b = buckets[key]
+        _merge_into(b["hdr"], h)
+        vmin, vmax = min(samples), max(samples)
+        b["min"] = vmin if b["min"] is None else min(b["min"], vmin)
+        b["max"] = vmax if b["max"] is None else max(b["max"], vmax)
+        b["count"] += int(h.total_count)
+        for t, val in key:
             b["tags"][t] = val
 
     # Build response objects
@@ -239,5 +382,6 @@ def process_request(influxdb3_local, query_parameters, request_headers, request_
     return {
         "groups": out_rows,
         "total_groups": len(out_rows),
-        "window": {"start": start, "end": end}
+        "window": window,
+        "histogram": "corrected" if corrected else "raw"
     }
\ No newline at end of file
@@ -4,10 +4,12 @@
 # Buckets align on :00/:05/:10/... (every 5 min) and run with a +2m ingest delay.
 
 from typing import Dict, Any, List, Tuple, DefaultDict
-from collections import defaultdict
+from collections import defaultdict, Counter
 from time import time_ns
 from datetime import datetime, timezone, timedelta
 import base64
+import heapq
+import json
 
 # ---- HDR binding detection ----
 _hdr_cls = None
@@ -30,6 +32,10 @@ HIGHEST_DEFAULT = 30_000_000_000  # 30s in ns
 UNIT = "ns"
 PCTS = (50.0, 90.0, 95.0, 99.0, 99.9)
 INGEST_DELAY_MIN_DEFAULT = 2      # evaluate window end as (now - delay)
+MAX_SESSIONS_DEFAULT = 0          # per-component session cap; 0 = unlimited
+OTHER_SESSION = "__other__"
+EXEMPLARS_K_DEFAULT = 0           # slowest samples kept per group; 0 = off (opt in per trigger)
+EXPECTED_INTERVAL_NS_DEFAULT = 0  # sender period for CO correction; 0 = off
 
 # ---- Helpers ----
 def _args_or_empty(a):
@@ -62,6 +68,76 @@ def _align_to_5m_boundary(dt: datetime) -> datetime:
     rem = dt.minute % 5
     return dt - timedelta(minutes=rem)
 
+def _push_exemplar(heap: list, k: int, item: Tuple[int, int, Any, str]) -> None:
+    """Bounded min-heap: keeps the k largest (value, seq, time, tag) items, O(log k)."""
+    if len(heap) < k:
+        heapq.heappush(heap, item)
+    elif item[0] > heap[0][0]:
+        heapq.heapreplace(heap, item)
+
+def _exemplars_json(heap: list) -> str:
+    """Slowest first; time is passed through as the engine returned it."""
+    out = [{"value": v, "time": t, "tag": tag}
+           for v, _, t, tag in sorted(heap, reverse=True)]
+    return json.dumps(out, default=str, separators=(",", ":"))
+
+def _corrected_copy(h, lowest: int, highest: int, sigfigs: int, interval: int):
+    """
+    Coordinated-omission-corrected copy of h (HDR copyCorrectedForCoordinatedOmission).
+    Works on recorded buckets (value, count) rather than individual samples, so
+    cost scales with distinct buckets, not with sample count.
+    """
+    c = _hdr_cls(lowest, highest, sigfigs)
+    recorded = [(v.value_iterated_to, v.count_at_value_iterated_to)
+                for v in h.get_recorded_iterator()]
+    corrected_fn = getattr(c, "record_corrected_value", None)
+    for value, count in recorded:
+        if corrected_fn is not None:
+            corrected_fn(value, interval, count)
+            continue
+        c.record_value(value, count)
+        missing = value - interval
+        while missing >= interval:
+            c.record_value(missing, count)
+            missing -= interval
+    return c
+
+def _cap_sessions(buckets, max_sessions: int, exemplars=None, exemplar_k: int = 0):
+    """
+    Keep the heaviest max_sessions sessions (by sample count) per component;
+    fold the rest into a single OTHER_SESSION bucket for that component.
+    Exemplar heaps (if given) are folded the same way, staying bounded at k.
+    Returns (buckets, folded_session_count).
+    """
+    if max_sessions <= 0:
+        return buckets, 0
+
+    by_comp: DefaultDict[str, List[str]] = defaultdict(list)
+    for (comp, sess) in buckets:
+        by_comp[comp].append(sess)
+
+    folded = 0
+    for comp, sessions in by_comp.items():
+        if len(sessions) <= max_sessions:
+            continue
+        # Heaviest first; ties broken by name so the kept set is stable
+        sessions.sort(key=lambda s: (-len(buckets[(comp, s)]), s))
+        other = buckets.pop((comp, OTHER_SESSION), [])
+        other_ex = exemplars.pop((comp, OTHER_SESSION), []) if exemplars is not None else []
+        for sess in sessions[max_sessions:]:
+            if sess == OTHER_SESSION:
+                continue
+            other.extend(buckets.pop((comp, sess)))
+            if exemplars is not None:
+                for item in exemplars.pop((comp, sess), []):
+                    _push_exemplar(other_ex, exemplar_k, item)
+            folded += 1
+        if other:
+            buckets[(comp, OTHER_SESSION)] = other
+        if other_ex:
+            exemplars[(comp, OTHER_SESSION)] = other_ex
+    return buckets, folded
+
 # ---- Entry point ----
 def process_scheduled_call(influxdb3_local, call_time: str, args):
     """
@@ -71,6 +147,10 @@ def process_scheduled_call(influxdb3_local, call_time: str, args):
       sigfigs=3
       ingest_delay_min=2
       extra_tags=k=v,k2=v2
+      max_sessions=0          # per-component cap; overflow merges into "__other__"
+      exemplars=0             # slowest samples kept per group; e.g. 5 to opt in (0 = off)
+      exemplar_tag=clordid    # optional streaming2 column identifying the message
+      expected_interval_ns=0  # sender period; >0 also writes a CO-corrected histogram (co_* fields)
     """
     _require_hdr()
     args = _args_or_empty(args)
@@ -90,6 +170,28 @@ def process_scheduled_call(influxdb3_local, call_time: str, args):
     except Exception:
         ingest_delay_min = INGEST_DELAY_MIN_DEFAULT
 
+    try:
+        max_sessions = int(args.get("max_sessions", str(MAX_SESSIONS_DEFAULT)))
+        if max_sessions < 0:
+            max_sessions = MAX_SESSIONS_DEFAULT
+    except Exception:
+        max_sessions = MAX_SESSIONS_DEFAULT
+
+    try:
+        exemplar_k = int(args.get("exemplars", str(EXEMPLARS_K_DEFAULT)))
+        if exemplar_k < 0:
+            exemplar_k = EXEMPLARS_K_DEFAULT
+    except Exception:
+        exemplar_k = EXEMPLARS_K_DEFAULT
+    exemplar_tag = (args.get("exemplar_tag", "") or "").strip()
+
+    try:
+        expected_interval_ns = int(args.get("expected_interval_ns", str(EXPECTED_INTERVAL_NS_DEFAULT)))
+        if expected_interval_ns < 0:
+            expected_interval_ns = EXPECTED_INTERVAL_NS_DEFAULT
+    except Exception:
+        expected_interval_ns = EXPECTED_INTERVAL_NS_DEFAULT
+
     extra = args.get("extra_tags", "") or ""
 
     # --- Compute aligned window ---
@@ -105,8 +207,11 @@ def process_scheduled_call(influxdb3_local, call_time: str, args):
     end_iso   = _iso_utc(end_dt)
 
     # Build query (explicit TIMESTAMP literals and quoted identifiers)
+    cols = '"time","component","session","latency"'
+    if exemplar_k and exemplar_tag:
+        cols += f',"{exemplar_tag}"'
     q = f"""
-      SELECT "time","component","session","latency"
+      SELECT {cols}
       FROM streaming2
       WHERE "time" >= TIMESTAMP '{start_iso}'
         AND "time"  < TIMESTAMP '{end_iso}'
@@ -120,6 +225,8 @@ def process_scheduled_call(influxdb3_local, call_time: str, args):
 
     # Group by (component, session)
     buckets: DefaultDict[Tuple[str, str], List[int]] = defaultdict(list)
+    exemplars: DefaultDict[Tuple[str, str], list] = defaultdict(list)
+    seq = 0
     for r in rows:
         comp = "" if r.get("component") is None else str(r["component"])
         sess = "" if r.get("session")   is None else str(r["session"])
@@ -134,11 +241,25 @@ def process_scheduled_call(influxdb3_local, call_time: str, args):
             continue
         buckets[(comp, sess)].append(x)
 
+        if exemplar_k:
+            # seq breaks value ties so time/tag are never compared
+            seq += 1
+            tag = r.get(exemplar_tag) if exemplar_tag else None
+            _push_exemplar(exemplars[(comp, sess)], exemplar_k,
+                           (x, seq, r.get("time"), "" if tag is None else str(tag)))
+
     if not buckets:
         influxdb3_local.info("hdr_downsample_5m: no valid samples after filtering",
                              {"window": f"{start_iso}..{end_iso}"})
         return
 
+    # Bound per-component cardinality before allocating any histograms
+    buckets, folded = _cap_sessions(buckets, max_sessions, exemplars, exemplar_k)
+    if folded:
+        influxdb3_local.info("hdr_downsample_5m: folded overflow sessions",
+                             {"folded": folded, "max_sessions": max_sessions,
+                              "into": OTHER_SESSION})
+
     # Parse extra tags once
     extra_tag_pairs = []
     if extra:
@@ -153,10 +274,11 @@ def process_scheduled_call(influxdb3_local, call_time: str, args):
         if not samples:
             continue
 
+        # One record per distinct value instead of per sample
         h = _hdr_cls(lowest, highest, sigfigs)
-        for x in samples:
+        for x, n in Counter(samples).items():
             try:
-                h.record_value(x)
+                h.record_value(x, n)
             except Exception:
                 pass
 
@@ -186,6 +308,26 @@ def process_scheduled_call(influxdb3_local, call_time: str, args):
             influxdb3_local.warn("hdr_downsample_5m: serialization failed; writing without histo_b64",
                                  {"error": str(e)})
 
+        # Coordinated-omission-corrected view, stored next to the raw one
+        if expected_interval_ns:
+            try:
+                hc = _corrected_copy(h, lowest, highest, sigfigs, expected_interval_ns)
+                for p in PCTS:
+                    fname = "co_p" + str(p).replace(".", "_")
+                    lb.float64_field(fname, hc.get_value_at_percentile(p))
+                lb.float64_field("co_max",  hc.get_max_value())
+                lb.uint64_field("co_count", int(hc.total_count))
+                lb.uint64_field("expected_interval_ns", expected_interval_ns)
+                lb.string_field("histo_co_b64", _encode_hist(hc))
+            except Exception as e:
+                influxdb3_local.warn("hdr_downsample_5m: CO correction failed; writing raw only",
+                                     {"error": str(e)})
+
+        # Slowest samples in this group, for percentile -> message drill-down
+        ex = exemplars.get((comp, sess))
+        if ex:
+            lb.string_field("exemplars", _exemplars_json(ex))
+
         # Use the ALIGNED boundary (end_dt) as the point timestamp
         lb.time_ns(int(end_dt.timestamp() * 1e9))
         influxdb3_local.write(lb)
@@ -193,4 +335,5 @@ def process_scheduled_call(influxdb3_local, call_time: str, args):
 
     influxdb3_local.info("hdr_downsample_5m: wrote buckets",
                          {"count": wrote, "window": f"{start_iso}..{end_iso}",
-                          "delay_min": ingest_delay_min, "sigfigs": sigfigs, "highest_ns": highest})
\ No newline at end of file
+                          "delay_min": ingest_delay_min, "sigfigs": sigfigs, "highest_ns": highest,
+                          "expected_interval_ns": expected_interval_ns})
\ No newline at end of file
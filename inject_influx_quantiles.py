@@ -1,9 +1,28 @@
+import argparse
+import csv
+import hashlib
 import os
+import queue
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import Manager
+
+import numpy as np
 import pandas as pd
-from influxdb_client import InfluxDBClient, Point, WritePrecision
-from influxdb_client.client.write_api import WriteOptions
+from influxdb_client import InfluxDBClient, WritePrecision
+from influxdb_client.client.write_api import SYNCHRONOUS
 from glob import glob
 
+from lp_spool import Spool
+
+# Streaming CSV reader: pyarrow if installed, else pandas chunks
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = pa_csv = None
+
 # InfluxDB connection setup
 influxdb_url = "http://localhost:8086"
 token = "your_api_token_here"
@@ -14,70 +33,357 @@ csv_dir = "./your_aggregated_csv_folder"
 # Static measurement name
 measurement = "aggregated_stats"
 
-# Create InfluxDB client and write API
-client = InfluxDBClient(url=influxdb_url, token=token, org=org)
-write_api = client.write_api(write_options=WriteOptions(
-    batch_size=5000,
-    flush_interval=2000,
-    jitter_interval=500,
-    retry_interval=5000,
-    write_type="asynchronous"
-))
-
-# Loop through CSV files
-for filepath in glob(os.path.join(csv_dir, "*.csv")):
-    try:
-        print(f"Processing file: {os.path.basename(filepath)}")
+# Value columns written as float fields ("." is replaced for field compatibility)
+FIELDS = [
+    "Max", "Mean", "Min",
+    "10", "25", "5", "50", "75",
+    "90", "95", "99", "99.9",
+    "message-count"
+]
+TAG_COLUMNS = ["MP", "window"]
+
+# Lines per write request; each batch is one pre-joined body
+BATCH_LINES = 50000
+# Bodies buffered per worker before workers block on the writer
+QUEUE_PER_WORKER = 2
+
+
+def _clean_quoted(col):
+    """Strip ="..." Excel-style quoting from a column, once per distinct value (NaN kept)."""
+    if pd.api.types.is_numeric_dtype(col):
+        return col
+    codes, uniques = pd.factorize(col)
+    cleaned = np.array([str(u).strip().strip('="') for u in uniques] + [None], dtype=object)
+    return pd.Series(cleaned[codes], index=col.index, dtype=object)
+
+
+def _escape_tag(v):
+    return v.replace("\\", "\\\\").replace(",", r"\,").replace("=", r"\=").replace(" ", r"\ ")
+
+
+def _tag_fragments(col, tag):
+    """',tag=value' per row, escaped once per distinct value; '' for NaN/empty."""
+    codes, uniques = pd.factorize(col)
+    frags = np.array([f",{tag}={_escape_tag(str(u))}" if str(u) != "" else "" for u in uniques] + [""],
+                     dtype=object)
+    return frags[codes]   # code -1 (NaN) picks the trailing ""
+
 
-        # Load CSV with "-" as NaN
-        df = pd.read_csv(filepath, na_values="-", low_memory=False)
+def clean_frame(df):
+    """Clean column names and the columns we write; convert fields to float."""
+    df.columns = [c.strip().strip('="') for c in df.columns]
+    for col in TAG_COLUMNS + ["time_start"]:
+        if col in df.columns:
+            df[col] = _clean_quoted(df[col])
+    for col in FIELDS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(_clean_quoted(df[col]), errors='coerce').astype("float64")
+    return df
 
-        # Clean column names
-        df.columns = [c.strip().strip('="') for c in df.columns]
 
-        # Strip ="..." formatting from string values
-        df = df.applymap(lambda x: str(x).strip().strip('="') if pd.notna(x) else x)
+def frame_to_line_protocol(df):
+    """
+    Build one line-protocol string per row, column-wise.
+    NaN fields are omitted; rows with no fields or no valid time_start are dropped.
+    """
+    if len(df) == 0:
+        return []
 
-        # Convert numeric columns
-        for col in df.columns:
-            if col not in ["MP", "time_start", "window"]:
-                df[col] = pd.to_numeric(df[col], errors='coerce')
+    # Parse timestamp from "time_start" column
+    ts = pd.to_datetime(df["time_start"], format="%Y-%m-%d %H:%M:%S", errors='coerce')
 
-        # Parse timestamp from "time_start" column
-        df["timestamp"] = pd.to_datetime(df["time_start"], format="%Y-%m-%d %H:%M:%S")
-        timestamp_ns = df["timestamp"].astype("int64")  # nanosecond precision
+    # measurement + tags (empty tag values are not allowed in line protocol)
+    head = np.full(len(df), measurement, dtype=object)
+    for tag in TAG_COLUMNS:
+        if tag in df.columns:
+            head = head + _tag_fragments(df[tag], tag)
+        else:
+            head = head + f",{tag}=unknown"
 
-        # Build Influx points
-        points = []
-        for idx, row in df.iterrows():
-            mp_tag = row["MP"]
-            window_tag = row.get("window", "unknown")
+    # fields, comma-joined, skipping NaN
+    fields = np.full(len(df), "", dtype=object)
+    for field in FIELDS:
+        if field not in df.columns:
+            continue
+        col = df[field].to_numpy()
+        present = ~np.isnan(col)
+        part = np.where(present, field.replace(".", "_") + "=" + col.astype(str).astype(object), "")
+        sep = np.where(present & (fields != ""), ",", "")
+        fields = fields + sep + part
 
-            point = Point(measurement).tag("MP", mp_tag).tag("window", window_tag)
+    keep = (fields != "") & ts.notna().to_numpy()
+    ts_ns = ts[keep].astype("datetime64[ns]").astype("int64").to_numpy().astype(str).astype(object)
+    return (head[keep] + " " + fields[keep] + " " + ts_ns).tolist()
 
-            for field in [
-                "Max", "Mean", "Min",
-                "10", "25", "5", "50", "75",
-                "90", "95", "99", "99.9",
-                "message-count"
-            ]:
-                if field in row and pd.notna(row[field]):
-                    safe_field = field.replace(".", "_")  # Replace dot for field compatibility
-                    point = point.field(safe_field, float(row[field]))
 
-            ts_ns = int(timestamp_ns.iloc[idx])
-            point = point.time(ts_ns, WritePrecision.NS)
+def iter_chunks(filepath, chunk_mb=16, skip_rows=0):
+    """
+    Yield the CSV as DataFrames of string columns ("-" as NaN) without loading
+    it whole, starting after the first skip_rows data rows.
+    """
+    if pa_csv is not None:
+        with open(filepath, newline="") as f:
+            names = next(csv.reader(f), [])
+        reader = pa_csv.open_csv(
+            filepath,
+            read_options=pa_csv.ReadOptions(block_size=chunk_mb << 20, skip_rows_after_names=skip_rows),
+            convert_options=pa_csv.ConvertOptions(column_types={n: pa.string() for n in names},
+                                                  null_values=["-"], strings_can_be_null=True))
+        for batch in reader:
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(filepath, na_values="-", dtype=str, chunksize=BATCH_LINES,
+                               skiprows=range(1, skip_rows + 1))
 
-            # Print InfluxDB line protocol string
-            print(point.to_line_protocol())
 
-            points.append(point)
+def iter_bodies(filepath, chunk_mb=16, skip_rows=0):
+    """
+    Yield (pre-joined line-protocol body, points, CSV rows consumed) per
+    BATCH_LINES rows of the file; rows consumed include rows that produced no point.
+    """
+    for chunk in iter_chunks(filepath, chunk_mb, skip_rows):
+        chunk = clean_frame(chunk)
+        for i in range(0, len(chunk), BATCH_LINES):
+            rows = chunk.iloc[i:i + BATCH_LINES]
+            lines = frame_to_line_protocol(rows)
+            yield "\n".join(lines), len(lines), len(rows)
 
-        write_api.write(bucket=bucket, org=org, record=points)
-        write_api.flush()
-        print(f"  → Wrote {len(points)} points.")
 
+def _convert_file(filepath, bodies, chunk_mb, skip_rows=0):
+    """
+    Pool worker: stream one file into the shared bounded queue.
+    Returns (points, bodies queued, error or None); bodies queued before an
+    error are still written, so a retry resumes at the failed chunk.
+    """
+    points = count = 0
+    try:
+        for body, n, rows in iter_bodies(filepath, chunk_mb, skip_rows):
+            bodies.put((filepath, body, n, rows))   # blocks while the writer is behind
+            points += n
+            count += 1
     except Exception as e:
-        print(f"  ✖ Error processing {filepath}: {e}")
+        return points, count, e
+    return points, count, None
+
+
+def _sha256(filepath, size, prefix=None):
+    """sha256 of the first `size` bytes, plus of the first `prefix` bytes if given."""
+    h = hashlib.sha256()
+    h_prefix = h.hexdigest() if prefix == 0 else None
+    done = 0
+    with open(filepath, "rb") as f:
+        while done < size:
+            limit = prefix if prefix is not None and h_prefix is None else size
+            block = f.read(min(1 << 20, limit - done))
+            if not block:
+                break
+            h.update(block)
+            done += len(block)
+            if done == prefix:
+                h_prefix = h.hexdigest()
+    return h.hexdigest(), h_prefix
+
+
+class Manifest:
+    """
+    SQLite record of what has been ingested, per CSV path:
+    size, mtime, sha256 of the content seen, CSV rows written and status
+    ('partial' while loading or after a failure, 'done' when complete).
+    """
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, sha256 TEXT,"
+            " rows INTEGER, status TEXT, updated REAL)")
+        self.db.commit()
+
+    def plan(self, filepath):
+        """
+        Data rows to skip for this file, or None if it is unchanged and done.
+        Records the file's current size/mtime/hash as the content being loaded.
+        """
+        path = os.path.abspath(filepath)
+        st = os.stat(filepath)
+        row = self.db.execute("SELECT size, mtime_ns, sha256, rows, status FROM files WHERE path = ?",
+                              (path,)).fetchone()
+        if row is not None and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+            if row[4] == "done":
+                return None
+            skip, sha = row[3], row[2]   # same content; retry from the failed chunk
+        else:
+            grew = row is not None and st.st_size > row[0]
+            sha, prefix_sha = _sha256(filepath, st.st_size, row[0] if grew else None)
+            # appended to: resume after the rows already written; otherwise start over
+            skip = row[3] if grew and prefix_sha == row[2] else 0
+        self.db.execute(
+            "INSERT OR REPLACE INTO files (path, size, mtime_ns, sha256, rows, status, updated)"
+            " VALUES (?, ?, ?, ?, ?, 'partial', ?)",
+            (path, st.st_size, st.st_mtime_ns, sha, skip, time.time()))
+        self.db.commit()
+        return skip
+
+    def progress(self, filepath, rows):
+        self.db.execute("UPDATE files SET rows = rows + ?, updated = ? WHERE path = ?",
+                        (rows, time.time(), os.path.abspath(filepath)))
+        self.db.commit()
+
+    def finish(self, filepath, ok):
+        self.db.execute("UPDATE files SET status = ?, updated = ? WHERE path = ?",
+                        ("done" if ok else "partial", time.time(), os.path.abspath(filepath)))
+        self.db.commit()
+
+
+class InfluxWriter:
+    """Writes bodies straight to InfluxDB; every successful write is durable."""
+
+    def __init__(self, write_api):
+        self.write_api = write_api
+
+    def write(self, body):
+        if body:
+            self.write_api.write(bucket=bucket, org=org, record=body, write_precision=WritePrecision.NS)
+        return True
+
+    def sync(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class _Progress:
+    """Rows written per file, reported to the manifest once the writer says they are on disk."""
+
+    def __init__(self, manifest):
+        self.manifest = manifest
+        self.unsynced = {}
+
+    def add(self, filepath, rows, durable):
+        self.unsynced[filepath] = self.unsynced.get(filepath, 0) + rows
+        if durable:
+            self.flush()
+
+    def flush(self):
+        if self.manifest is not None:
+            for filepath, rows in self.unsynced.items():
+                self.manifest.progress(filepath, rows)
+        self.unsynced.clear()
+
+    def finish(self, writer, filepath, ok):
+        writer.sync()
+        self.flush()
+        if self.manifest is not None:
+            self.manifest.finish(filepath, ok)
+
+
+def _plan(manifest, files):
+    """[(file, data rows to skip)] for files that need loading."""
+    todo = []
+    for filepath in files:
+        skip = manifest.plan(filepath) if manifest is not None else 0
+        if skip is None:
+            print(f"Skipping unchanged file: {os.path.basename(filepath)}")
+        else:
+            todo.append((filepath, skip))
+    return todo
+
+
+def ingest_sequential(writer, todo, chunk_mb, manifest=None):
+    progress = _Progress(manifest)
+    for filepath, skip in todo:
+        ok = False
+        try:
+            print(f"Processing file: {os.path.basename(filepath)}" + (f" (from row {skip})" if skip else ""))
+            points = 0
+            for body, n, rows in iter_bodies(filepath, chunk_mb, skip):
+                progress.add(filepath, rows, writer.write(body))
+                points += n
+            ok = True
+            print(f"  → Wrote {points} points.")
+
+        except Exception as e:
+            print(f"  ✖ Error processing {filepath}: {e}")
+        finally:
+            progress.finish(writer, filepath, ok)
+
+
+def ingest_parallel(writer, todo, workers, chunk_mb, manifest=None):
+    """
+    Convert files in a process pool; this process is the single writer (and
+    the only one touching the manifest). The queue is bounded, so workers
+    stall (instead of growing memory) whenever InfluxDB is slower than conversion.
+    """
+    written = {}    # file -> bodies taken off the queue
+    expected = {}   # file -> (points, bodies, error) once its worker has finished
+    failed = set()  # files with a failed write; their remaining bodies are dropped
+    progress = _Progress(manifest)
+
+    def finish_if_complete(filepath):
+        if filepath in expected and written.get(filepath, 0) == expected[filepath][1]:
+            points, _, error = expected.pop(filepath)
+            if error is not None:
+                print(f"  ✖ Error processing {filepath}: {error}")
+            elif filepath not in failed:
+                print(f"Processed {os.path.basename(filepath)}: {points} points.")
+            progress.finish(writer, filepath, error is None and filepath not in failed)
+
+    with Manager() as manager:
+        bodies = manager.Queue(maxsize=workers * QUEUE_PER_WORKER)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = {pool.submit(_convert_file, f, bodies, chunk_mb, skip): f for f, skip in todo}
+            while pending or expected:
+                try:
+                    filepath, body, n, rows = bodies.get(timeout=0.5)
+                except queue.Empty:
+                    pass
+                else:
+                    written[filepath] = written.get(filepath, 0) + 1
+                    if filepath not in failed:
+                        try:
+                            progress.add(filepath, rows, writer.write(body))
+                        except Exception as e:
+                            failed.add(filepath)
+                            print(f"  ✖ Error writing {filepath}: {e}")
+                    finish_if_complete(filepath)
+                for fut in [f for f in pending if f.done()]:
+                    filepath = pending.pop(fut)
+                    expected[filepath] = fut.result()
+                    finish_if_complete(filepath)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load aggregated quantile CSVs into InfluxDB")
+    parser.add_argument("--csv-dir", default=csv_dir, help="Directory of *.csv files")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Conversion processes (1 = convert and write in this process)")
+    parser.add_argument("--chunk-mb", type=int, default=16, help="CSV bytes parsed per chunk")
+    parser.add_argument("--manifest", default=None,
+                        help="SQLite ingest manifest (default <csv-dir>/.ingest_manifest.sqlite; '' disables)")
+    parser.add_argument("--spool", help="Append compressed line protocol to this directory instead of writing "
+                                        "to InfluxDB (drain it with lp_spool.py)")
+    parser.add_argument("--spool-segment-mb", type=int, default=16, help="Uncompressed MB per spool segment")
+    parser.add_argument("--spool-fsync-every", type=int, default=8, help="Bodies between spool fsyncs")
+    args = parser.parse_args()
+    if args.manifest is None:
+        args.manifest = os.path.join(args.csv_dir, ".ingest_manifest.sqlite")
+
+    if args.spool:
+        client = None
+        writer = Spool(args.spool, args.spool_segment_mb, args.spool_fsync_every)
+    else:
+        # Create InfluxDB client and write API
+        client = InfluxDBClient(url=influxdb_url, token=token, org=org, enable_gzip=True)
+        writer = InfluxWriter(client.write_api(write_options=SYNCHRONOUS))
+
+    manifest = Manifest(args.manifest) if args.manifest else None
+    todo = _plan(manifest, sorted(glob(os.path.join(args.csv_dir, "*.csv"))))
+    if args.workers > 1:
+        ingest_parallel(writer, todo, args.workers, args.chunk_mb, manifest)
+    else:
+        ingest_sequential(writer, todo, args.chunk_mb, manifest)
 
-client.close()
+    writer.close()
+    if client is not None:
+        client.close()
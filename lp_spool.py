@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Durable local spool for line protocol, and a replayer that drains it.
+
+Writers (e.g. inject_influx_quantiles.py --spool DIR) append bodies to an
+open segment as gzip members; the segment is fsync'ed every `fsync_every`
+bodies and on close, then atomically renamed to *.lp.gz. Only closed
+segments are replayed. Segments left open by a crashed writer are salvaged
+(complete gzip members kept) the next time a Spool opens the directory;
+use one writer process per directory.
+
+The replayer posts each closed segment as one gzip request, at most
+--rate-mb MB/s of line protocol, and moves it to DIR/done/ (or deletes it)
+after a 2xx. A crash between the post and the move re-sends that segment on
+the next run, which InfluxDB treats as an overwrite of identical points.
+Connection errors, 429 and 5xx are retried with backoff; any other 4xx
+(bad line protocol, auth) is permanent and the segment is moved to
+DIR/failed/ so the rest of the spool keeps draining. A closed segment that
+does not decode completely is moved to DIR/failed/ without being sent.
+
+  python lp_spool.py DIR --url 'http://host:8086/api/v2/write?org=o&bucket=b&precision=ns' --token T
+  python lp_spool.py DIR --url 'http://host:8181/api/v3/write_lp?db=d&precision=nanosecond' --follow
+"""
+import argparse
+import gzip
+import os
+import time
+import urllib.error
+import urllib.request
+import zlib
+
+SEGMENT_SUFFIX = '.lp.gz'
+OPEN_SUFFIX = '.lp.gz.open'
+
+
+def _fsync_dir(directory):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _complete_members(data):
+    """
+    (decompressed content of the complete gzip members at the start of data,
+    number of trailing bytes that are not a complete member).
+    """
+    out = []
+    while data:
+        d = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        try:
+            chunk = d.decompress(data)
+        except zlib.error:
+            break
+        if not d.eof:
+            break
+        out.append(chunk)
+        data = d.unused_data
+    return b''.join(out), len(data)
+
+
+def list_segments(directory):
+    """Closed segments, oldest first."""
+    return sorted(f for f in os.listdir(directory) if f.endswith(SEGMENT_SUFFIX))
+
+
+class Spool:
+    """
+    Append-only writer of compressed line-protocol segments.
+    write(body) returns True when everything written so far is on disk.
+    """
+
+    def __init__(self, directory, segment_mb=16, fsync_every=8, level=5):
+        self.directory = directory
+        self.segment_bytes = segment_mb << 20
+        self.fsync_every = fsync_every
+        self.level = level
+        self._f = None
+        self._path = None
+        self._raw = 0
+        self._unsynced = 0
+        self._seq = 0
+        os.makedirs(directory, exist_ok=True)
+        self._salvage()
+
+    def _salvage(self):
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(OPEN_SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            with open(path, 'rb') as f:
+                data, dropped = _complete_members(f.read())
+            if dropped:
+                print(f"Salvaged {name}: dropped {dropped} bytes of incomplete gzip data")
+            if data:
+                with open(path, 'wb') as f:
+                    f.write(gzip.compress(data, self.level))
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(path, path[:-len('.open')])
+            else:
+                os.unlink(path)
+        _fsync_dir(self.directory)
+
+    def _open(self):
+        self._seq += 1
+        name = f"{time.time_ns():020d}-{os.getpid()}-{self._seq:06d}{OPEN_SUFFIX}"
+        self._path = os.path.join(self.directory, name)
+        self._f = open(self._path, 'ab')
+        self._raw = 0
+
+    def write(self, body):
+        if not body:
+            return self._unsynced == 0
+        if self._f is None:
+            self._open()
+        data = (body if body.endswith('\n') else body + '\n').encode('utf-8')
+        self._f.write(gzip.compress(data, self.level))
+        self._raw += len(data)
+        self._unsynced += 1
+        if self._raw >= self.segment_bytes:
+            self._close_segment()
+            return True
+        if self._unsynced >= self.fsync_every:
+            self.sync()
+            return True
+        return False
+
+    def sync(self):
+        if self._f is not None and self._unsynced:
+            self._f.flush()
+            os.fsync(self._f.fileno())
+        self._unsynced = 0
+
+    def _close_segment(self):
+        self.sync()
+        self._f.close()
+        os.replace(self._path, self._path[:-len('.open')])
+        _fsync_dir(self.directory)
+        self._f = self._path = None
+
+    def close(self):
+        if self._f is not None:
+            self._close_segment()
+
+
+class Replayer:
+    """Posts closed segments oldest first, rate-limited, marking each done after a 2xx."""
+
+    def __init__(self, directory, url, token=None, rate_mb=0.0, keep=True, timeout=30.0):
+        self.directory = directory
+        self.url = url
+        self.token = token
+        self.rate = rate_mb * (1 << 20)
+        self.keep = keep
+        self.timeout = timeout
+        self.done_dir = os.path.join(directory, 'done')
+        self.failed_dir = os.path.join(directory, 'failed')
+        self._backoff = 0.0
+
+    def _post(self, body):
+        req = urllib.request.Request(self.url, data=body, method='POST')
+        req.add_header('Content-Type', 'text/plain; charset=utf-8')
+        req.add_header('Content-Encoding', 'gzip')
+        if self.token:
+            req.add_header('Authorization', f"Token {self.token}")
+        with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+            resp.read()
+
+    def _mark_done(self, name):
+        path = os.path.join(self.directory, name)
+        if self.keep:
+            os.makedirs(self.done_dir, exist_ok=True)
+            os.replace(path, os.path.join(self.done_dir, name))
+        else:
+            os.unlink(path)
+
+    def _mark_failed(self, name):
+        os.makedirs(self.failed_dir, exist_ok=True)
+        os.replace(os.path.join(self.directory, name), os.path.join(self.failed_dir, name))
+
+    def drain(self):
+        """Replay every closed segment present now; returns (segments, bytes) sent."""
+        sent = nbytes = 0
+        for name in list_segments(self.directory):
+            with open(os.path.join(self.directory, name), 'rb') as f:
+                data = f.read()
+            raw, trailing = _complete_members(data)
+            if trailing:
+                # closed segments are fsync'ed whole: a bad member is corruption, not a crash tail
+                print(f"Segment {name} has {trailing} corrupt bytes after {len(raw)} bytes of line protocol; "
+                      f"moved to failed/")
+                self._mark_failed(name)
+                continue
+            t0 = time.monotonic()
+            failed = False
+            while raw:
+                try:
+                    # all members recompressed as one: some servers only read the first gzip member
+                    self._post(gzip.compress(raw, 5))
+                    break
+                except urllib.error.HTTPError as e:
+                    if 400 <= e.code < 500 and e.code != 429:
+                        # the server rejected this segment; retrying cannot help
+                        print(f"Replay of {name} rejected ({e.code} {e.reason}), moved to failed/")
+                        failed = True
+                        break
+                    self._retry_wait(name, e)
+                except Exception as e:
+                    self._retry_wait(name, e)
+            self._backoff = 0.0
+            if failed:
+                self._mark_failed(name)
+                continue
+            self._mark_done(name)
+            sent += 1
+            nbytes += len(raw)
+            if self.rate:
+                time.sleep(max(0.0, len(raw) / self.rate - (time.monotonic() - t0)))
+        return sent, nbytes
+
+    def _retry_wait(self, name, error):
+        self._backoff = min(60.0, max(1.0, self._backoff * 2))
+        print(f"Replay of {name} failed, retrying in {self._backoff:.0f}s: {error}")
+        time.sleep(self._backoff)
+
+    def run(self, follow=False, poll=5.0):
+        while True:
+            sent, nbytes = self.drain()
+            if sent:
+                print(f"Replayed {sent} segments ({nbytes / 2**20:.1f} MiB)")
+            if not follow:
+                return
+            time.sleep(poll)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay a line-protocol spool into InfluxDB')
+    parser.add_argument('directory', help='Spool directory')
+    parser.add_argument('--url', required=True, help='Write URL (v2 /api/v2/write?... or v3 /api/v3/write_lp?...)')
+    parser.add_argument('--token', default=os.environ.get('INFLUX_TOKEN'), help='API token (default $INFLUX_TOKEN)')
+    parser.add_argument('--rate-mb', type=float, default=0.0, help='Max MB/s of line protocol (0 = unlimited)')
+    parser.add_argument('--delete', action='store_true', help='Delete replayed segments instead of moving to done/')
+    parser.add_argument('--follow', action='store_true', help='Keep polling for new segments')
+    parser.add_argument('--poll', type=float, default=5.0, help='Seconds between polls with --follow')
+    args = parser.parse_args()
+
+    Replayer(args.directory, args.url, args.token, args.rate_mb, keep=not args.delete).run(args.follow, args.poll)
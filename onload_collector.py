@@ -1,98 +1,99 @@
 from prometheus_client import start_http_server, Gauge
-import subprocess
+from prometheus_client.core import REGISTRY
 import time
-import re
 import threading
 import argparse
+from collections import OrderedDict
+
+from onload_stackdump import (
+    StackdumpSource, StackFilter, parse_sections, sanitize_metric_suffix, add_stack_args, SELF_METRICS,
+)
 
 # Dynamic Prometheus metrics storage
 metrics = {}
 
-# Regex to find important blocks and key-value pairs
-CI_NETIF_DUMP_HEADER_RE = re.compile(r'ci_netif_dump_to_logger', re.IGNORECASE)
-STACK_INFO_RE = re.compile(r'stack=(\d+)', re.IGNORECASE)
-PID_INFO_RE = re.compile(r'Onload\s+([\d\.]+).*?pid=(\d+)', re.IGNORECASE)
-CI_NETIF_STATS_HEADER_RE = re.compile(r'ci_netif_stats:\s*(\d+)', re.IGNORECASE)
-CI_NETIF_STATS_LINE_RE = re.compile(r'\s*(\w+)\s*:\s*(\d+)', re.IGNORECASE)
-
+# section -> (metric prefix, help prefix, label names, label values(stack, sub))
+NAMING = {
+    'ci_netif_stats': (
+        'onload_netif_', 'Onload netif stat',
+        ['stack_id', 'onload_version', 'pid'],
+        lambda st, sub: (st.stack_id, st.version, st.pid),
+    ),
+    'vi': (
+        'onload_vi_', 'Onload vi stat',
+        ['stack_id', 'interface_id', 'device_id', 'hw_addr'],
+        lambda st, sub: (st.stack_id, sub.intf, sub.dev, sub.hw),
+    ),
+    'sockets': (
+        'onload_sockets_', 'Onload socket stat',
+        ['stack_id', 'proto', 'sock_index', 'lcl', 'rmt', 'state'],
+        lambda st, sub: (st.stack_id, sub.proto, sub.sock_index, sub.lcl, sub.rmt, sub.state),
+    ),
+}
+
+
+# (metric_name, label values tuple) -> generation of the scrape that last set it,
+# ordered by last stamp: stale labelsets are always at the front
+_last_seen = OrderedDict()
+_generation = 0
+
+
+def scrape_once(source):
+    """
+    One onload_stackdump run: update Gauges and drop labelsets not seen this time.
+    Returns the number of samples set.
+    """
+    global _generation
+    updates = []
+    counts = {}
+
+    # Parse the whole dump first so a failed/timed-out run changes nothing
+    for section, stack, sub, key, val in source.events():
+        prefix, help_prefix, label_names, label_fn = NAMING[section]
+        metric_name = prefix + sanitize_metric_suffix(key)
+
+        if metric_name not in metrics:
+            metrics[metric_name] = Gauge(
+                metric_name,
+                f"{help_prefix} {key}",
+                label_names
+            )
 
-def scrape_onload_stats(scrape_interval):
+        updates.append((metric_name, label_fn(stack, sub), val))
+        counts[section] = counts.get(section, 0) + 1
+
+    SELF_METRICS.samples_emitted(counts)
+    _generation += 1
+    gen = _generation
+    fresh = 0
+    for metric_name, labels, val in updates:
+        values = tuple(str(v) for v in labels)
+        metrics[metric_name].labels(*values).set(val)
+        key = (metric_name, values)
+        if _last_seen.get(key) != gen:
+            _last_seen[key] = gen
+            fresh += 1
+        _last_seen.move_to_end(key)
+
+    # Cleanup stale labelsets (including when no output or no stacks found):
+    # whatever was not stamped with this generation. Stale keys sit before
+    # every current one, so this pops exactly the churn; no prometheus_client
+    # internals are touched.
+    while len(_last_seen) > fresh:
+        (metric_name, values), _gen = _last_seen.popitem(last=False)
+        metrics[metric_name].remove(*values)
+
+    return len(updates)
+
+
+def scrape_onload_stats(scrape_interval, sections=('ci_netif_stats',), stack_filter=None, workers=0, test_file=None):
     """
-    Periodically scrape Onload ci_netif_stats by parsing global onload_stackdump lots output.
+    Periodically scrape Onload ci_netif_stats by parsing onload_stackdump lots output.
     """
+    source = StackdumpSource(sections, None, stack_filter, workers, require_pid=False, test_file=test_file)
     while True:
         try:
-            output = subprocess.check_output(
-                ['onload_stackdump', 'lots'], universal_newlines=True
-            )
-
-            inside_dump = False
-            current_stack_id = None
-            current_onload_version = None
-            current_pid = None
-            ready_for_stats = False
-            seen_labels = set()
-
-            # Parse each line; if output is empty, skip parsing and proceed to cleanup
-            for line in output.splitlines():
-                if CI_NETIF_DUMP_HEADER_RE.search(line):
-                    inside_dump = True
-                    continue
-
-                if inside_dump:
-                    m_stack = STACK_INFO_RE.search(line)
-                    if m_stack:
-                        current_stack_id = m_stack.group(1)
-                        continue
-
-                    m_pid = PID_INFO_RE.search(line)
-                    if m_pid:
-                        current_onload_version, current_pid = m_pid.groups()
-                        continue
-
-                    m_stats_header = CI_NETIF_STATS_HEADER_RE.search(line)
-                    if m_stats_header:
-                        stats_stack_id = m_stats_header.group(1)
-                        ready_for_stats = (stats_stack_id == current_stack_id)
-                        continue
-
-                    if ready_for_stats:
-                        m_line = CI_NETIF_STATS_LINE_RE.search(line)
-                        if m_line:
-                            key, val = m_line.groups()
-                            metric_name = f"onload_netif_{key.lower()}"
-
-                            if metric_name not in metrics:
-                                metrics[metric_name] = Gauge(
-                                    metric_name,
-                                    f"Onload netif stat {key}",
-                                    ['stack_id', 'onload_version', 'pid']
-                                )
-
-                            labels = {
-                                'stack_id': current_stack_id,
-                                'onload_version': current_onload_version,
-                                'pid': current_pid
-                            }
-                            # Track seen labels for cleanup
-                            labels_fset = frozenset(labels.items())
-                            seen_labels.add((metric_name, labels_fset))
-                            metrics[metric_name].labels(**labels).set(int(val))
-
-            # Cleanup stale metrics, including when no output or no stacks found
-            for metric_name, metric_obj in metrics.items():
-                to_remove = []
-                for label_tuple in list(metric_obj._metrics.keys()):
-                    # Reconstruct label dict from tuple
-                    names = metric_obj._labelnames
-                    label_dict = dict(zip(names, label_tuple))
-                    labels_fset = frozenset(label_dict.items())
-                    if (metric_name, labels_fset) not in seen_labels:
-                        to_remove.append(label_tuple)
-                # Remove stale labelsets
-                for label_tuple in to_remove:
-                    metric_obj.remove(*label_tuple)
-
+            scrape_once(source)
         except Exception as e:
             print(f"Error scraping onload_stackdump lots: {e}")
 
@@ -111,12 +112,19 @@ if __name__ == '__main__':
         '--port', type=int, default=9100,
         help='HTTP port for Prometheus metrics'
     )
+    parser.add_argument(
+        '--sections', default='ci_netif_stats',
+        help='Comma-separated sections to parse (ci_netif_stats,vi,sockets)'
+    )
+    add_stack_args(parser)
     args = parser.parse_args()
 
+    REGISTRY.register(SELF_METRICS)
     start_http_server(args.port)
     thread = threading.Thread(
         target=scrape_onload_stats,
-        args=(args.scrape_interval,)
+        args=(args.scrape_interval, parse_sections(args.sections),
+              StackFilter(args.stack_include, args.stack_exclude), args.workers, args.test_file)
     )
     thread.daemon = True
     thread.start()
@@ -0,0 +1,183 @@
+"""
+Fast exposition path for the Onload exporters.
+
+Renders group_samples() output straight to Prometheus text (0.0.4) or
+OpenMetrics text, skipping CounterMetricFamily/add_metric and
+prometheus_client's generic formatter. Escaped label strings and metric
+headers are cached across scrapes (socket and stack identities are stable
+between dumps). Each snapshot is rendered and gzip-compressed once in the
+sampler thread; the built-in HTTP handler only picks the right bytes and
+appends a tiny dynamic tail (snapshot age, high-frequency gauges).
+
+Gzip responses are two concatenated gzip members (cached body + tail), which
+RFC 1952 decoders - including Prometheus' - read as one stream.
+"""
+import gzip
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_TYPE_PROM = 'text/plain; version=0.0.4; charset=utf-8'
+CONTENT_TYPE_OM = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+GZIP_LEVEL = 5
+INF = float('inf')
+
+
+def _escape_label(v):
+    return v.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _escape_help(v):
+    return v.replace('\\', r'\\').replace('\n', r'\n')
+
+
+def _fmt_value(v):
+    if isinstance(v, int):
+        return str(v)
+    v = float(v)
+    # the text formats spell special values NaN/+Inf/-Inf, not Python's nan/inf
+    if v != v:
+        return 'NaN'
+    if v == INF:
+        return '+Inf'
+    if v == -INF:
+        return '-Inf'
+    return repr(v)
+
+
+class ExpositionRenderer:
+    """Text renderer with label-string and header caches shared across scrapes."""
+
+    def __init__(self, max_cached_labels=1_000_000):
+        self._labels = {}    # (label names, label values) -> '{a="x",b="y"}'
+        self._headers = {}   # (name, help, type, openmetrics) -> (header text, sample name)
+        self.max_cached_labels = max_cached_labels
+
+    def _label_str(self, names, values):
+        key = (names, values)
+        s = self._labels.get(key)
+        if s is None:
+            if not names:
+                s = ''
+            else:
+                s = '{' + ','.join(f'{n}="{_escape_label(str(v))}"' for n, v in zip(names, values)) + '}'
+            if len(self._labels) >= self.max_cached_labels:
+                # socket churn can grow this without bound; start over
+                self._labels.clear()
+            self._labels[key] = s
+        return s
+
+    def _header(self, name, help_text, mtype, openmetrics):
+        key = (name, help_text, mtype, openmetrics)
+        h = self._headers.get(key)
+        if h is None:
+            if mtype == 'counter':
+                base = name[:-6] if name.endswith('_total') else name
+                family, sample = (base, base + '_total') if openmetrics else (base + '_total', base + '_total')
+            else:
+                family = sample = name
+            text = f"# HELP {family} {_escape_help(help_text)}\n# TYPE {family} {mtype}\n"
+            h = self._headers[key] = (text, sample)
+        return h
+
+    def render_samples(self, data, naming, openmetrics=False):
+        """group_samples() output (all counters) -> exposition text (no '# EOF')."""
+        out = []
+        append = out.append
+        label_str = self._label_str
+        for (section, name), samples in data.items():
+            _prefix, help_text, label_names, _fn = naming[section]
+            names = tuple(label_names)
+            header, sample_name = self._header(name, help_text, 'counter', openmetrics)
+            append(header)
+            for labels, val in samples:
+                append(f"{sample_name}{label_str(names, tuple(labels))} {_fmt_value(val)}\n")
+        return ''.join(out)
+
+    def render_families(self, families, openmetrics=False):
+        """Small prometheus_client families (gauges/counters) -> exposition text."""
+        out = []
+        for fam in families:
+            header, _ = self._header(fam.name, fam.documentation, fam.type, openmetrics)
+            out.append(header)
+            for s in fam.samples:
+                if s.name.endswith('_created'):
+                    continue
+                names = tuple(s.labels.keys())
+                vals = tuple(s.labels.values())
+                out.append(f"{s.name}{self._label_str(names, vals)} {_fmt_value(s.value)}\n")
+        return ''.join(out)
+
+
+class RenderedSnapshot:
+    """Pre-rendered (and pre-gzipped) bodies of one sample, keyed by openmetrics flag."""
+
+    def __init__(self, bodies):
+        self.bodies = bodies
+
+
+class FastExporter:
+    """
+    Serves pre-rendered snapshots from a SnapshotSampler over HTTP.
+
+    sampler:  SnapshotSampler whose build() returns snapshot(data, naming)
+    extra:    callable returning small families rendered per request (may be None)
+    """
+
+    def __init__(self, renderer, sampler=None, extra=None):
+        self.renderer = renderer
+        self.sampler = sampler
+        self.extra = extra
+        self._lock = threading.Lock()   # renderer caches are shared with request threads
+
+    def snapshot(self, data, naming):
+        """Render and compress one sample in both formats (runs in the sampler thread)."""
+        bodies = {}
+        for om in (False, True):
+            with self._lock:
+                raw = self.renderer.render_samples(data, naming, om).encode('utf-8')
+            bodies[om] = (raw, gzip.compress(raw, GZIP_LEVEL))
+        return RenderedSnapshot(bodies)
+
+    def payload(self, openmetrics, want_gzip):
+        snap, age = self.sampler.latest()
+        families = [self.sampler.age_family(age)]
+        if self.extra is not None:
+            families.extend(self.extra())
+        with self._lock:
+            tail = self.renderer.render_families(families, openmetrics)
+        if openmetrics:
+            tail += '# EOF\n'
+        tail = tail.encode('utf-8')
+        raw, gz = snap.bodies[openmetrics] if snap is not None else (b'', b'')
+        if want_gzip:
+            return (gz + gzip.compress(tail, GZIP_LEVEL)) if gz else gzip.compress(tail, GZIP_LEVEL)
+        return raw + tail
+
+    def serve(self, port, addr=''):
+        exporter = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?', 1)[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                accept = self.headers.get('Accept', '')
+                om = 'application/openmetrics-text' in accept
+                gz = 'gzip' in self.headers.get('Accept-Encoding', '')
+                body = exporter.payload(om, gz)
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE_OM if om else CONTENT_TYPE_PROM)
+                if gz:
+                    self.send_header('Content-Encoding', 'gzip')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        httpd = ThreadingHTTPServer((addr, port), Handler)
+        httpd.daemon_threads = True
+        t = threading.Thread(target=httpd.serve_forever, name='fast-exporter-http', daemon=True)
+        t.start()
+        return httpd
@@ -0,0 +1,248 @@
+"""
+Line-protocol push sink for the Onload exporters.
+
+Turns group_samples() output into InfluxDB line protocol (one line per
+labelset: tags = labels, fields = that section's keys) and pushes batches on
+a timer to an HTTP write endpoint, e.g. InfluxDB 3:
+
+    http://host:8181/api/v3/write_lp?db=onload&precision=nanosecond
+
+Bodies are gzip-compressed. Failed batches stay in a bounded queue and are
+retried with backoff (connection errors, 429, 5xx); when the queue is full the
+oldest batch is dropped. A batch rejected with any other 4xx (bad line
+protocol, auth, too large) is dropped at once so it cannot block later ones.
+Outcomes are counted in onload_exporter_push_batches{result}.
+
+Optionally, selected gauges (e.g. socket snd_q_len / rcv_q_len) are recorded
+into HDR histograms per (stack, key) and 5m window and written as
+`onload_5m` rows with the same p*/min/max/count/unit/histo_b64 fields the
+latency_5m downsampler (influxdb3/hdrhistogram.py) writes, so network-stack
+health can be merged and joined like trading latency.
+"""
+import base64
+import gzip
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import deque
+
+from onload_stackdump import sanitize_metric_suffix, SELF_METRICS
+
+# ---- HDR binding detection (same bindings as the influxdb3 plugins) ----
+_hdr_cls = None
+_err = None
+try:
+    from hdrhistogram import HdrHistogram as _Hdr
+    _hdr_cls = _Hdr
+except Exception as e1:
+    _err = e1
+    try:
+        from hdrh.histogram import HdrHistogram as _Hdr
+        _hdr_cls = _Hdr
+    except Exception as e2:
+        _err = (e1, e2)
+
+HDR_MEASUREMENT = 'onload_5m'
+HDR_LOWEST = 1
+HDR_HIGHEST = 1 << 32
+HDR_SIGFIGS = 3
+HDR_WINDOW_S = 300
+PCTS = (50.0, 90.0, 95.0, 99.0, 99.9)
+
+
+def add_push_args(parser):
+    """argparse options for PushSink."""
+    parser.add_argument('--push-url', help='Line-protocol write URL; enables push mode')
+    parser.add_argument('--push-token', help='Bearer token for the write endpoint (default $INFLUX_TOKEN)')
+    parser.add_argument('--push-interval', type=float, default=10.0, help='Seconds between pushes')
+    parser.add_argument('--push-queue', type=int, default=100, help='Max batches held for retry')
+    parser.add_argument('--hdr-gauges', default='',
+                        help='Comma-separated keys recorded into 5m HDR histograms (e.g. snd_q_len,rcv_q_len)')
+
+
+def _escape_measurement(s):
+    return s.replace(',', r'\,').replace(' ', r'\ ')
+
+
+def _escape_tag(s):
+    return s.replace('\\', '\\\\').replace(',', r'\,').replace('=', r'\=').replace(' ', r'\ ')
+
+
+def _escape_str_field(s):
+    return s.replace('\\', '\\\\').replace('"', r'\"')
+
+
+def _tags(names, values):
+    # empty tag values are not allowed in line protocol
+    return ''.join(f",{n}={_escape_tag(str(v))}" for n, v in zip(names, values) if v not in (None, ''))
+
+
+def to_line_protocol(data, naming, ts_ns):
+    """
+    group_samples() output -> list of line-protocol strings.
+    Measurement is the section's metric prefix without the trailing '_'.
+    """
+    rows = {}   # (section, label values) -> [field, ...]
+    for (section, name), samples in data.items():
+        prefix = naming[section][0]
+        field = name[len(prefix):] if name.startswith(prefix) else name
+        for labels, val in samples:
+            rows.setdefault((section, tuple(labels)), []).append(f"{field}={int(val)}i")
+    out = []
+    for (section, values), fields in rows.items():
+        prefix, _help, names, _fn = naming[section]
+        out.append(f"{_escape_measurement(prefix.rstrip('_'))}{_tags(names, values)} {','.join(fields)} {ts_ns}")
+    return out
+
+
+def _encode_hist(h):
+    if hasattr(h, "encode"):
+        return base64.b64encode(h.encode()).decode("ascii")
+    if hasattr(h, "to_byte_array"):
+        return base64.b64encode(h.to_byte_array()).decode("ascii")
+    raise RuntimeError("HDR binding lacks encode(); cannot serialize histogram.")
+
+
+class HdrWindows:
+    """
+    Per (stack_id, stack_name, key) HDR histograms over aligned 5m windows.
+    Closed windows are flushed as line protocol stamped at the window end,
+    matching the latency_5m convention.
+    """
+
+    def __init__(self, keys, window_s=HDR_WINDOW_S):
+        if _hdr_cls is None:
+            raise RuntimeError(f"HDRHistogram not found (pip install hdrhistogram). Import errors: {_err}")
+        self.keys = frozenset(sanitize_metric_suffix(k) for k in keys)
+        self.window_ns = int(window_s * 1e9)
+        self._hists = {}   # (window_end_ns, stack_id, stack_name, key) -> hist
+
+    def record(self, data, naming, ts_ns):
+        end = (ts_ns // self.window_ns + 1) * self.window_ns
+        for (section, name), samples in data.items():
+            prefix, _help, names, _fn = naming[section]
+            key = sanitize_metric_suffix(name[len(prefix):])
+            if key not in self.keys:
+                continue
+            i_id = names.index('stack_id')
+            i_name = names.index('stack_name') if 'stack_name' in names else None
+            for labels, val in samples:
+                if val < 0:
+                    continue
+                hk = (end, labels[i_id], labels[i_name] if i_name is not None else '', key)
+                h = self._hists.get(hk)
+                if h is None:
+                    h = self._hists[hk] = _hdr_cls(HDR_LOWEST, HDR_HIGHEST, HDR_SIGFIGS)
+                try:
+                    h.record_value(int(val))
+                except Exception:
+                    pass
+
+    def flush(self, now_ns, force=False):
+        """Line protocol for windows that ended at or before now_ns (all if force)."""
+        out = []
+        for hk in [k for k in self._hists if force or k[0] <= now_ns]:
+            end, stack_id, stack_name, key = hk
+            h = self._hists.pop(hk)
+            if h.total_count == 0:
+                continue
+            fields = [f"p{str(p).replace('.', '_')}={float(h.get_value_at_percentile(p))}" for p in PCTS]
+            fields += [
+                f"min={float(h.get_min_value())}",
+                f"max={float(h.get_max_value())}",
+                f"count={int(h.total_count)}u",
+                'unit="count"',
+                f'histo_b64="{_escape_str_field(_encode_hist(h))}"',
+            ]
+            tags = _tags(('stack_id', 'stack_name', 'metric'), (stack_id, stack_name, key))
+            out.append(f"{HDR_MEASUREMENT}{tags} {','.join(fields)} {end}")
+        return out
+
+
+class PushSink:
+    """
+    Collects line protocol via offer() (called from the sampler thread) and
+    pushes it every `interval` seconds from its own thread.
+    """
+
+    def __init__(self, url, token=None, interval=10.0, max_batches=100, hdr_keys=None, timeout=5.0):
+        self.url = url
+        self.token = token
+        self.interval = interval
+        self.timeout = timeout
+        self.hdr = HdrWindows(hdr_keys) if hdr_keys else None
+        self._pending = []                       # lines not yet batched
+        self._queue = deque(maxlen=max_batches)  # gzip bodies awaiting (re)send
+        self._lock = threading.Lock()
+        self.dropped_batches = 0
+        self.rejected_batches = 0
+        self.sent_batches = 0
+        self._backoff = 0.0
+
+    def start(self):
+        threading.Thread(target=self._run, name='onload-push', daemon=True).start()
+        return self
+
+    def offer(self, data, naming):
+        ts_ns = time.time_ns()
+        lines = to_line_protocol(data, naming, ts_ns)
+        with self._lock:
+            self._pending.extend(lines)
+            if self.hdr is not None:
+                self.hdr.record(data, naming, ts_ns)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval + self._backoff)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Push failed: {e}")
+
+    def flush(self, force=False):
+        with self._lock:
+            lines, self._pending = self._pending, []
+            if self.hdr is not None:
+                lines.extend(self.hdr.flush(time.time_ns(), force))
+        if lines:
+            if len(self._queue) == self._queue.maxlen:
+                self.dropped_batches += 1
+                SELF_METRICS.push_done('dropped')
+            self._queue.append(gzip.compress(('\n'.join(lines) + '\n').encode('utf-8')))
+
+        while self._queue:
+            body = self._queue[0]
+            try:
+                self._post(body)
+            except urllib.error.HTTPError as e:
+                if 400 <= e.code < 500 and e.code != 429:
+                    # the server refuses this batch; retrying cannot help
+                    self._queue.popleft()
+                    self.rejected_batches += 1
+                    SELF_METRICS.push_done('rejected')
+                    print(f"Push to {self.url} rejected ({e.code} {e.reason}); batch dropped")
+                    continue
+                self._retry_later(e)
+                return
+            except Exception as e:
+                self._retry_later(e)
+                return
+            self._queue.popleft()
+            self.sent_batches += 1
+            SELF_METRICS.push_done('sent')
+            self._backoff = 0.0
+
+    def _retry_later(self, error):
+        # keep the batch for the next round; back off up to 1 minute
+        self._backoff = min(60.0, max(1.0, self._backoff * 2))
+        print(f"Push to {self.url} failed ({len(self._queue)} batches queued): {error}")
+
+    def _post(self, body):
+        req = urllib.request.Request(self.url, data=body, method='POST')
+        req.add_header('Content-Type', 'text/plain; charset=utf-8')
+        req.add_header('Content-Encoding', 'gzip')
+        if self.token:
+            req.add_header('Authorization', f"Bearer {self.token}")
+        with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+            resp.read()
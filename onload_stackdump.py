@@ -0,0 +1,1098 @@
+"""
+Shared single-pass parser for `onload_stackdump lots` output.
+
+Used by all onload_collector*.py exporters. Output is read line by line from
+the subprocess (never held in memory as a whole) and each line is routed by
+its first non-blank character to a small set of handlers, so most lines cost
+one dict lookup plus at most one regex.
+
+Parsed samples are yielded as events:
+    (section, stack, sub, key, value)
+      section: 'ci_netif_stats' | 'vi' | 'sockets'
+      stack:   Stack(stack_id, stack_name, version, pid)
+      sub:     None | Vi(...) | Socket(...)
+      key:     raw key as printed by onload_stackdump (socket keys may carry
+               a 'prefix.' such as 'listenq.max')
+      value:   int
+group_samples()/build_families() turn events into metric families using a
+naming table (DEFAULT_NAMING, or an exporter's own).
+
+StackdumpCollector is the common base of the onload_collector_* exporters
+(background sampling, high-frequency counters, push, collect()); each
+exporter supplies its source, naming table and optional event reducer, and
+add_collector_args()/start_from_args() wire up the shared options.
+
+SELF_METRICS records the exporter's own cost (stackdump run time/outcome,
+bytes and lines read, parse CPU time, samples per section, RSS, CPU) and is
+registered by every exporter as onload_exporter_*.
+"""
+import heapq
+import math
+import os
+import re
+import signal
+import subprocess
+import threading
+import time
+from collections import namedtuple, deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import islice
+
+SECTIONS = ('ci_netif_stats', 'vi', 'sockets')
+STACKDUMP_CMD = ['onload_stackdump', 'lots']
+LIST_STACKS_CMD = ['onload_stackdump']
+# per-stack dump; {stack_id} is substituted
+STACK_DUMP_CMD = ['onload_stackdump', '{stack_id}', 'lots']
+# ci_netif_stats blocks only, without the sockets/vi walk of 'lots' (high-frequency polls)
+STATS_CMD = ['onload_stackdump', 'stats']
+# parser events produced per timed batch (see StackdumpParser.parse)
+PARSE_BATCH = 512
+# seconds a stack listing is reused to name stacks seen in STATS_CMD output
+STACK_LIST_TTL = 10.0
+
+Stack = namedtuple('Stack', 'stack_id stack_name version pid')
+Vi = namedtuple('Vi', 'intf dev hw')
+Socket = namedtuple('Socket', 'proto sock_index lcl rmt state')
+
+# Regex patterns
+DUMP_HEADER_RE = re.compile(
+    r'^ci_netif_dump_to_logger:\s*stack=(?P<stack_id>\d+)(?:\s+name=(?P<stack_name>\S*))?',
+    re.IGNORECASE
+)
+VI_HEADER_RE = re.compile(
+    r'^ci_netif_dump_vi:\s*stack=(?P<stack_id>\d+)\s+intf=(?P<intf>\S+)\s+dev=(?P<dev>\S+)\s+hw=(?P<hw>\S+)',
+    re.IGNORECASE
+)
+ONLOAD_PID_RE = re.compile(r'Onload\s+(?P<version>[\d\.]+).*?pid=(?P<pid>\d+)', re.IGNORECASE)
+SECTION_RE = re.compile(r'^-+\s*(?P<header>\w+):\s*(?P<stack_id>\d+)\s*-+', re.IGNORECASE)
+SOCKETS_OPEN_RE = re.compile(r'^-+\s*sockets\s*-+', re.IGNORECASE)
+METRIC_RE = re.compile(r'^(?P<key>[\w\.]+)\s*:\s*(?P<val>\d+)')
+# 'TCP 1:23 lcl=... rmt=... ESTABLISHED'
+SOCK_HDR_RE = re.compile(r'^(TCP|UDP)\s+(\d+):(\d+)\s+lcl=(\S+)\s+rmt=(\S+)\s+(\S+)\s*$')
+# 'TCP stack_id:1 lcl=... rmt=...'
+SOCK_HDR_ALT_RE = re.compile(r'^(TCP|UDP)\s+stack_id:(\d+)\s+lcl=(\S+)\s+rmt=(\S+)', re.IGNORECASE)
+SOCK_KV_RE = re.compile(r'([A-Za-z0-9_.\-]+)=(\S+)')
+_NUMERIC_TOKEN_RE = re.compile(r'^[+-]?(?:0[xX][0-9a-fA-F]+|\d+)$')
+# 'onload_stackdump' with no command: '#stack-id stack-name pids' then one row per stack
+STACK_LIST_RE = re.compile(r'^\s*(?P<stack_id>\d+)\s+(?P<stack_name>\S+)(?:\s+(?P<pids>\S+))?')
+_WS_RE = re.compile(r'\s+')
+_NON_METRIC_RE = re.compile(r'[^a-zA-Z0-9_]')
+_MULTI_US_RE = re.compile(r'__+')
+
+
+@lru_cache(maxsize=4096)
+def sanitize_metric_suffix(key: str) -> str:
+    """
+    Prometheus-safe metric suffix from a parsed key (lowercase, [a-z0-9_],
+    no repeated underscores). Cached: the key set is small and fixed.
+    """
+    k = key.strip().lower().replace(' ', '_').replace('.', '_')
+    k = _NON_METRIC_RE.sub('_', k)
+    return _MULTI_US_RE.sub('_', k)
+
+
+def to_int_or_none(val: str):
+    """
+    Only accept strictly numeric tokens (decimal or hex), e.g. 123, -1, 0x10.
+    Rejects ESTABLISHED, 0(0), 10ms, 1,234, ...
+    """
+    if not _NUMERIC_TOKEN_RE.match(val):
+        return None
+    try:
+        return int(val, 0)
+    except ValueError:
+        return None
+
+
+def iter_socket_kv(line: str):
+    """
+    Yield (key, value_str) pairs from a metrics line inside a socket block.
+    A leading label such as 'listenq:' or 'TX timestamping queue:' becomes a
+    key prefix; spaces in the prefix become underscores.
+    """
+    first_colon = line.find(':')
+    first_equal = line.find('=')
+    if first_colon != -1 and (first_equal == -1 or first_colon < first_equal):
+        prefix = _WS_RE.sub('_', line[:first_colon].strip())
+        body = line[first_colon + 1:]
+    else:
+        prefix = None
+        body = line
+    for k, v in SOCK_KV_RE.findall(body):
+        yield (f"{prefix}.{k}" if prefix else k, v)
+
+
+def parse_sections(spec: str):
+    """'ci_netif_stats,vi' -> {'ci_netif_stats', 'vi'}; rejects unknown names."""
+    out = set(s.strip().lower() for s in spec.split(',') if s.strip())
+    unknown = out.difference(SECTIONS)
+    if unknown:
+        raise ValueError(f"unknown sections: {', '.join(sorted(unknown))} (valid: {', '.join(SECTIONS)})")
+    return out
+
+
+class ExporterMetrics:
+    """
+    The exporter's own cost, exposed as a prometheus_client collector:
+    onload_stackdump run time (per caller: 'dump' for the main dumps, 'hf' for
+    high-frequency polls) and outcome, bytes/lines read, parse CPU time,
+    samples emitted per section, line-protocol push batches by outcome, and
+    process RSS / CPU seconds.
+    Updated from sampler and worker threads; reads take a consistent copy.
+    """
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+    def __init__(self, name='onload_exporter'):
+        self.name = name
+        self._lock = threading.Lock()
+        self._dumps = {}   # caller -> histogram
+        self._parse = self._new_hist()
+        self._runs = {'ok': 0, 'timeout': 0, 'error': 0}
+        self._bytes = 0
+        self._lines = 0
+        self._samples = {}
+        self._push = {'sent': 0, 'dropped': 0, 'rejected': 0}
+
+    def _new_hist(self):
+        return {'buckets': [0] * len(self.BUCKETS), 'sum': 0.0, 'count': 0}
+
+    def _observe(self, h, seconds):
+        for i, le in enumerate(self.BUCKETS):
+            if seconds <= le:
+                h['buckets'][i] += 1
+                break
+        h['sum'] += seconds
+        h['count'] += 1
+
+    def stackdump_done(self, seconds, nbytes, nlines, result, caller='dump'):
+        with self._lock:
+            h = self._dumps.get(caller)
+            if h is None:
+                h = self._dumps[caller] = self._new_hist()
+            self._observe(h, seconds)
+            self._runs[result] += 1
+            self._bytes += nbytes
+            self._lines += nlines
+
+    def parse_done(self, cpu_seconds):
+        with self._lock:
+            self._observe(self._parse, cpu_seconds)
+
+    def samples_emitted(self, counts):
+        with self._lock:
+            for section, n in counts.items():
+                self._samples[section] = self._samples.get(section, 0) + n
+
+    def push_done(self, result):
+        """One PushSink batch: 'sent', 'dropped' (queue full) or 'rejected' (permanent 4xx)."""
+        with self._lock:
+            self._push[result] += 1
+
+    @staticmethod
+    def _rss_bytes():
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError, IndexError):
+            return float('nan')
+
+    def _cumulative(self, buckets):
+        cum, acc = [], 0
+        for le, n in zip(self.BUCKETS, buckets):
+            acc += n
+            cum.append(('+Inf' if le == float('inf') else repr(le), acc))
+        return cum
+
+    def collect(self):
+        from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, HistogramMetricFamily
+        with self._lock:
+            dumps = {k: (list(v['buckets']), v['sum']) for k, v in self._dumps.items()}
+            parse = (list(self._parse['buckets']), self._parse['sum'])
+            runs = dict(self._runs)
+            nbytes, nlines = self._bytes, self._lines
+            samples = dict(self._samples)
+            push = dict(self._push)
+
+        h = HistogramMetricFamily(f"{self.name}_stackdump_seconds", 'Wall time of onload_stackdump runs',
+                                  labels=['caller'])
+        for caller, (buckets, total) in dumps.items():
+            h.add_metric([caller], self._cumulative(buckets), total)
+        yield h
+        yield HistogramMetricFamily(f"{self.name}_parse_seconds", 'Thread CPU time spent parsing one dump',
+                                    buckets=self._cumulative(parse[0]), sum_value=parse[1])
+
+        c = CounterMetricFamily(f"{self.name}_stackdump_runs", "onload_stackdump runs by result", labels=['result'])
+        for result, n in runs.items():
+            c.add_metric([result], n)
+        yield c
+        yield CounterMetricFamily(f"{self.name}_read_bytes", "Bytes of onload_stackdump output read", value=nbytes)
+        yield CounterMetricFamily(f"{self.name}_read_lines", "Lines of onload_stackdump output read", value=nlines)
+        c = CounterMetricFamily(f"{self.name}_samples", "Metric samples emitted per section", labels=['section'])
+        for section, n in samples.items():
+            c.add_metric([section], n)
+        yield c
+        c = CounterMetricFamily(f"{self.name}_push_batches", "Line-protocol push batches by outcome",
+                                labels=['result'])
+        for result, n in push.items():
+            c.add_metric([result], n)
+        yield c
+
+        t = os.times()
+        yield CounterMetricFamily(f"{self.name}_cpu_seconds", "Exporter user+system CPU time",
+                                  value=t.user + t.system)
+        yield GaugeMetricFamily(f"{self.name}_resident_memory_bytes", "Exporter resident set size",
+                                value=self._rss_bytes())
+
+
+SELF_METRICS = ExporterMetrics()
+
+
+def stream_stackdump(timeout, cmd=None, caller='dump'):
+    """
+    Run onload_stackdump and yield its stdout line by line; the run is
+    recorded in SELF_METRICS under `caller`.
+    Raises subprocess.TimeoutExpired / CalledProcessError like check_output,
+    but only after the lines read so far have been yielded; callers should
+    discard partial results on error.
+    """
+    cmd = list(cmd or STACKDUMP_CMD)
+    # own process group so a timeout also reaps any children holding stdout open
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                            universal_newlines=True, bufsize=1 << 16, start_new_session=True)
+    timed_out = threading.Event()
+
+    def _kill():
+        timed_out.set()
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+    timer = threading.Timer(timeout, _kill) if timeout else None
+    if timer:
+        timer.daemon = True
+        timer.start()
+    t0 = time.monotonic()
+    nbytes = nlines = 0
+    rc = None
+    try:
+        for line in proc.stdout:
+            nbytes += len(line)
+            nlines += 1
+            yield line
+        rc = proc.wait()
+    finally:
+        result = 'timeout' if timed_out.is_set() else ('ok' if rc == 0 else 'error')
+        SELF_METRICS.stackdump_done(time.monotonic() - t0, nbytes, nlines, result, caller)
+        if timer:
+            timer.cancel()
+        if proc.poll() is None:
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+            except OSError:
+                pass
+            proc.wait()
+        proc.stdout.close()
+    if timed_out.is_set():
+        raise subprocess.TimeoutExpired(cmd, timeout)
+    if rc != 0:
+        raise subprocess.CalledProcessError(rc, cmd)
+
+
+def read_lines(path):
+    """Yield lines of a saved onload_stackdump dump (for --test-file)."""
+    with open(path) as f:
+        for line in f:
+            yield line
+
+
+def add_stack_args(parser):
+    """argparse options shared by the exporters for stack selection / parallel dumps."""
+    parser.add_argument('--stack-include', help='Regex on stack name; only matching stacks are exported')
+    parser.add_argument('--stack-exclude', help='Regex on stack name; matching stacks are skipped')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='Dump selected stacks in parallel with this many workers (0 = one global dump)')
+    parser.add_argument('--test-file', help='Optional path to onload_stackdump output for testing')
+
+
+def list_stacks(timeout, cmd=None, caller='dump'):
+    """[(stack_id, stack_name, pids), ...] from the onload_stackdump stack listing ('-' = unnamed)."""
+    out = []
+    for line in stream_stackdump(timeout, cmd or LIST_STACKS_CMD, caller):
+        m = STACK_LIST_RE.match(line)
+        if m:
+            name = m.group('stack_name')
+            out.append((m.group('stack_id'), '' if name == '-' else name, m.group('pids')))
+    return out
+
+
+class StackFilter:
+    """Include/exclude regexes on stack name (re.search); empty include = all."""
+
+    def __init__(self, include=None, exclude=None):
+        self.include = re.compile(include) if include else None
+        self.exclude = re.compile(exclude) if exclude else None
+
+    def __bool__(self):
+        return self.include is not None or self.exclude is not None
+
+    def __call__(self, stack_name):
+        name = stack_name or ''
+        if self.include is not None and not self.include.search(name):
+            return False
+        if self.exclude is not None and self.exclude.search(name):
+            return False
+        return True
+
+
+class StackdumpSource:
+    """
+    Produces parser events for one collection.
+
+    workers=0: one global 'onload_stackdump lots' (stack filter applied to events).
+    test_file: parse a saved dump instead of running onload_stackdump.
+    workers>0: list stacks, keep those passing the filter, and dump each one with
+               its own invocation on a bounded thread pool. timeout then applies
+               per stack; a stack that times out or fails is skipped, so
+               collection time is set by the slowest selected stack.
+    stats_only: run 'onload_stackdump stats' (ci_netif_stats only, no socket
+               walk) instead; stack names and pids come from a stack listing
+               reused for STACK_LIST_TTL seconds. workers is ignored.
+    caller:    label for this source's runs in SELF_METRICS.
+    reducer:   optional events -> events stage (e.g. SocketReducer.reduce) run
+               inside each per-stack worker, so a worker hands back only its
+               stack's aggregates rather than every socket event. It must be
+               safe to apply again over the merged stacks (SocketReducer is).
+    """
+
+    def __init__(self, sections, timeout, stack_filter=None, workers=0, require_pid=True, socket_keys=None,
+                 test_file=None, stats_only=False, caller='dump', reducer=None):
+        self.sections = frozenset(sections)
+        self.reducer = reducer
+        self.stats_only = stats_only
+        self.caller = caller
+        self._stacks = {}        # stack_id -> (stack_name, pids), for stats_only
+        self._stacks_at = None
+        self.test_file = test_file
+        self.require_pid = require_pid
+        self.socket_keys = socket_keys
+        self.timeout = timeout
+        self.stack_filter = stack_filter or StackFilter()
+        self.workers = workers
+        self._pool = (ThreadPoolExecutor(max_workers=workers, thread_name_prefix='stackdump')
+                      if workers > 0 and not stats_only else None)
+
+    def events(self):
+        if self.stats_only:
+            return self._stats_events()
+        if self._pool is None or self.test_file:
+            return self._global_events()
+        return self._per_stack_events()
+
+    def _global_events(self):
+        lines = read_lines(self.test_file) if self.test_file else stream_stackdump(self.timeout, caller=self.caller)
+        events = StackdumpParser(self.sections, self.require_pid, self.socket_keys).parse(lines)
+        if not self.stack_filter:
+            return events
+        keep = self.stack_filter
+        return (e for e in events if keep(e[1].stack_name))
+
+    def _dump_one(self, stack_id):
+        # parser state is per stack: one parser per task
+        cmd = [a.format(stack_id=stack_id) for a in STACK_DUMP_CMD]
+        parser = StackdumpParser(self.sections, self.require_pid, self.socket_keys)
+        events = parser.parse(stream_stackdump(self.timeout, cmd, self.caller))
+        if self.reducer is not None:
+            events = self.reducer(events)
+        return list(events)
+
+    def _per_stack_events(self):
+        stacks = [sid for sid, name, _pids in list_stacks(self.timeout, caller=self.caller) if self.stack_filter(name)]
+        futures = [(sid, self._pool.submit(self._dump_one, sid)) for sid in stacks]
+        events = []
+        for sid, fut in futures:
+            try:
+                events.extend(fut.result())
+            except subprocess.TimeoutExpired:
+                print(f"Timeout: onload_stackdump hung on stack {sid}")
+            except Exception as e:
+                print(f"onload_stackdump failed on stack {sid}: {e}")
+        return events
+
+    def _stats_events(self):
+        lines = read_lines(self.test_file) if self.test_file else stream_stackdump(self.timeout, STATS_CMD, self.caller)
+        parser = StackdumpParser(self.sections, require_pid=False, stats_only=True)
+        events = list(parser.parse(lines))
+
+        # bare stats blocks carry only the stack id: name them from the listing
+        named = {}
+        for ev in events:
+            st = ev[1]
+            if st.stack_id not in named:
+                named[st.stack_id] = st if st.pid is not None else None
+        missing = [sid for sid, st in named.items() if st is None]
+        if missing and not self.test_file:
+            now = time.monotonic()
+            age = now - self._stacks_at if self._stacks_at is not None else float('inf')
+            unknown = any(sid not in self._stacks for sid in missing)
+            # relist when the listing is old, or (at most once a second) when a new stack shows up
+            if age > STACK_LIST_TTL or (unknown and age > 1.0):
+                self._stacks_at = now
+                try:
+                    self._stacks = {sid: (name, pids) for sid, name, pids
+                                    in list_stacks(self.timeout, caller=self.caller)}
+                except (subprocess.SubprocessError, OSError) as e:
+                    print(f"onload_stackdump stack listing failed: {e}")
+        for sid in missing:
+            name, pids = self._stacks.get(sid, ('', None))
+            named[sid] = Stack(sid, name, None, pids)
+
+        keep = self.stack_filter
+        out = []
+        for section, st, sub, key, val in events:
+            st = named[st.stack_id]
+            if not keep or keep(st.stack_name):
+                out.append((section, st, sub, key, val))
+        return out
+
+
+class StackdumpParser:
+    """
+    Single-pass state machine over onload_stackdump lines.
+
+    sections:    subset of SECTIONS to emit
+    require_pid: only emit once the 'Onload <version> ... pid=' line of the
+                 current stack has been seen
+    socket_keys: optional allow-list of sanitized socket keys (e.g. 'snd_q_len');
+                 other socket keys are dropped before value conversion
+    stats_only:  'onload_stackdump stats' output, which has no dump header: a
+                 ci_netif_stats section header for a new stack id opens that
+                 stack (name/version/pid unknown)
+    """
+
+    def __init__(self, sections=('ci_netif_stats',), require_pid=True, socket_keys=None, stats_only=False):
+        self.sections = frozenset(sections)
+        self.stats_only = stats_only
+        self.require_pid = require_pid
+        self.socket_keys = frozenset(sanitize_metric_suffix(k) for k in socket_keys) if socket_keys else None
+        # first non-blank char -> handler; handlers return True if they
+        # consumed the line, else it falls through to the section handler
+        self._dispatch = {
+            'c': self._on_c,
+            '-': self._on_dash,
+            '=': self._on_equals,
+        }
+        if 'sockets' in self.sections:
+            self._dispatch['T'] = self._on_sock_hdr
+            self._dispatch['U'] = self._on_sock_hdr
+        self._reset()
+
+    def _reset(self):
+        self._stack_id = None
+        self._stack_name = ''
+        self._version = None
+        self._pid = None
+        self._stack = None
+        self._section = None   # one of SECTIONS or None
+        self._sub = None       # Vi / Socket for the current block
+
+    # ---- public ----
+    def parse(self, lines):
+        """
+        Yield (section, stack, sub, key, value) for every sample in lines.
+        Events are produced in batches of PARSE_BATCH so only the parser's own
+        thread CPU time is recorded, not the consumer's between yields; a run
+        the consumer abandons early is still recorded.
+        """
+        events = self._parse(lines)
+        cpu = 0.0
+        try:
+            while True:
+                t0 = time.thread_time()
+                batch = list(islice(events, PARSE_BATCH))
+                cpu += time.thread_time() - t0
+                if not batch:
+                    return
+                yield from batch
+        finally:
+            SELF_METRICS.parse_done(cpu)
+
+    def _parse(self, lines):
+        self._reset()
+        dispatch = self._dispatch
+        section_handlers = {
+            'ci_netif_stats': self._on_netif_line,
+            'vi': self._on_vi_line,
+            'sockets': self._on_socket_line,
+        }
+        for raw in lines:
+            line = raw.strip()
+            if not line:
+                continue
+
+            # version/pid line follows the stack header
+            if self._stack_id is not None and self._version is None:
+                m = ONLOAD_PID_RE.search(line)
+                if m:
+                    self._version = m.group('version')
+                    self._pid = m.group('pid')
+                    self._stack = Stack(self._stack_id, self._stack_name, self._version, self._pid)
+                    continue
+
+            h = dispatch.get(line[0])
+            if h is not None and h(line):
+                continue
+
+            if self._section is None or self._stack is None:
+                continue
+            yield from section_handlers[self._section](line)
+
+    # ---- prefix handlers ----
+    def _on_c(self, line):
+        if line.startswith('ci_netif_dump_to_logger'):
+            m = DUMP_HEADER_RE.match(line)
+            if not m:
+                return False
+            self._reset()
+            self._stack_id = m.group('stack_id')
+            self._stack_name = m.group('stack_name') or ''
+            if not self.require_pid:
+                self._stack = Stack(self._stack_id, self._stack_name, None, None)
+            return True
+        if line.startswith('ci_netif_dump_vi'):
+            self._section = None
+            self._sub = None
+            if 'vi' not in self.sections:
+                return True
+            m = VI_HEADER_RE.match(line)
+            if m and m.group('stack_id') == self._stack_id:
+                self._section = 'vi'
+                self._sub = Vi(m.group('intf'), m.group('dev'), m.group('hw'))
+            return True
+        return False
+
+    def _on_dash(self, line):
+        if not line.strip('-').strip():
+            # dashed separator ends a socket block
+            if self._section == 'sockets':
+                self._sub = None
+            return True
+        self._sub = None
+        if SOCKETS_OPEN_RE.match(line):
+            self._section = 'sockets' if 'sockets' in self.sections else None
+            return True
+        m = SECTION_RE.match(line)
+        if (m and self.stats_only and 'ci_netif_stats' in self.sections
+                and m.group('header').lower() == 'ci_netif_stats'
+                and m.group('stack_id') != self._stack_id):
+            self._reset()
+            self._stack_id = m.group('stack_id')
+            self._version = ''   # no version/pid line follows
+            self._stack = Stack(self._stack_id, '', None, None)
+        if (m and 'ci_netif_stats' in self.sections
+                and m.group('header').lower() == 'ci_netif_stats'
+                and m.group('stack_id') == self._stack_id):
+            self._section = 'ci_netif_stats'
+        else:
+            self._section = None
+        return True
+
+    def _on_equals(self, line):
+        if line.strip('='):
+            return False
+        # '=====' separates stack blocks
+        self._reset()
+        return True
+
+    def _on_sock_hdr(self, line):
+        if self._section != 'sockets':
+            return False
+        m = SOCK_HDR_RE.match(line)
+        if m:
+            proto, _stack_num, sock_index, lcl, rmt, state = m.groups()
+            self._sub = Socket(proto, sock_index, lcl, rmt, state)
+            return True
+        m = SOCK_HDR_ALT_RE.match(line)
+        if m:
+            proto, _stack_num, lcl, rmt = m.groups()
+            self._sub = Socket(proto.upper(), '', lcl, rmt, '')
+            return True
+        return False
+
+    # ---- section handlers ----
+    def _on_netif_line(self, line):
+        m = METRIC_RE.match(line)
+        if m:
+            yield ('ci_netif_stats', self._stack, None, m.group('key'), int(m.group('val')))
+
+    def _on_vi_line(self, line):
+        m = METRIC_RE.match(line)
+        if m:
+            yield ('vi', self._stack, self._sub, m.group('key'), int(m.group('val')))
+
+    def _on_socket_line(self, line):
+        sock = self._sub
+        if sock is None:
+            return
+        allow = self.socket_keys
+        emitted = False
+        for k, v_str in iter_socket_kv(line):
+            if allow is not None and sanitize_metric_suffix(k) not in allow:
+                continue
+            ival = to_int_or_none(v_str)
+            if ival is None:
+                continue
+            emitted = True
+            yield ('sockets', self._stack, sock, k, ival)
+        if not emitted and '=' not in line:
+            m = METRIC_RE.match(line)
+            if m and (allow is None or sanitize_metric_suffix(m.group('key')) in allow):
+                yield ('sockets', self._stack, sock, m.group('key'), int(m.group('val')))
+
+
+# ---- metric naming ----
+# section -> (metric prefix, help text, label names, labels(stack, sub))
+DEFAULT_NAMING = {
+    'ci_netif_stats': (
+        'onload_ci_netif_stats_', 'Onload ci_netif_stats metric',
+        ['stack_id', 'pid', 'onload_version', 'stack_name'],
+        lambda st, sub: [st.stack_id, st.pid, st.version, st.stack_name],
+    ),
+    'vi': (
+        'onload_vi_stats_', 'vi interface stats',
+        ['stack_id', 'interface_id', 'device_id', 'hw_addr'],
+        lambda st, sub: [st.stack_id, sub.intf, sub.dev, sub.hw],
+    ),
+    'sockets': (
+        'onload_sockets_', 'Onload sockets metrics parsed from --- sockets --- section',
+        ['stack_id', 'pid', 'onload_version', 'stack_name',
+         'proto', 'sock_index', 'lcl', 'rmt', 'state'],
+        lambda st, sub: [st.stack_id, st.pid, st.version, st.stack_name,
+                         sub.proto, sub.sock_index, sub.lcl, sub.rmt, sub.state],
+    ),
+}
+
+
+SOCKET_AGG_MODES = ('none', 'stack', 'proto_state', 'topk')
+
+
+def socket_naming(mode, base=DEFAULT_NAMING):
+    """Naming table whose sockets entry matches the labels left by SocketReducer(mode)."""
+    naming = dict(base)
+    prefix, help_text, names, label_fn = base['sockets']
+    if mode == 'stack':
+        naming['sockets'] = (prefix, help_text + ' (summed per stack)', names[:4],
+                             lambda st, sub: [st.stack_id, st.pid, st.version, st.stack_name])
+    elif mode == 'proto_state':
+        naming['sockets'] = (prefix, help_text + ' (summed per proto/state)', names[:4] + ['proto', 'state'],
+                             lambda st, sub: [st.stack_id, st.pid, st.version, st.stack_name, sub.proto, sub.state])
+    return naming
+
+
+class SocketReducer:
+    """
+    Bounds socket-series cardinality on the event stream, before any samples
+    are grouped or families built. Non-socket events pass straight through.
+
+    mode='stack':       one sum per (stack, key)
+    mode='proto_state': one sum per (stack, proto, state, key)
+    mode='topk':        keep every key of the k sockets with the largest
+                        `topk_by` value (sanitized key, e.g. 'snd_q_len');
+                        only k sockets are ever held in memory
+    mode='none':        unchanged
+    """
+
+    def __init__(self, mode='none', topk=10, topk_by=None):
+        if mode not in SOCKET_AGG_MODES:
+            raise ValueError(f"unknown socket aggregation mode {mode!r} (valid: {', '.join(SOCKET_AGG_MODES)})")
+        if mode == 'topk' and not topk_by:
+            raise ValueError("socket aggregation 'topk' needs a metric to rank by")
+        self.mode = mode
+        self.topk = topk
+        self.topk_by = sanitize_metric_suffix(topk_by) if topk_by else None
+
+    def reduce(self, events):
+        if self.mode == 'none':
+            return events
+        if self.mode == 'topk':
+            return self._topk(events)
+        return self._sum(events)
+
+    def _sum(self, events):
+        by_state = self.mode == 'proto_state'
+        sums = {}
+        for ev in events:
+            if ev[0] != 'sockets':
+                yield ev
+                continue
+            _, st, sub, key, val = ev
+            key = sanitize_metric_suffix(key)
+            group = (st, sub.proto, sub.state, key) if by_state else (st, key)
+            sums[group] = sums.get(group, 0) + val
+        for group, total in sums.items():
+            if by_state:
+                st, proto, state, key = group
+                yield ('sockets', st, Socket(proto, '', '', '', state), key, total)
+            else:
+                st, key = group
+                yield ('sockets', st, None, key, total)
+
+    def _topk(self, events):
+        heap = []      # (rank, seq, stack, sock, [(key, val), ...])
+        seq = 0
+        cur = cur_stack = None
+        cur_vals = []
+        rank = 0
+
+        def _flush():
+            item = (rank, seq, cur_stack, cur, cur_vals)
+            if len(heap) < self.topk:
+                heapq.heappush(heap, item)
+            elif rank > heap[0][0]:
+                heapq.heapreplace(heap, item)
+
+        for ev in events:
+            if ev[0] != 'sockets':
+                yield ev
+                continue
+            _, st, sub, key, val = ev
+            if sub is not cur:
+                if cur is not None:
+                    _flush()
+                seq += 1
+                cur, cur_stack, cur_vals, rank = sub, st, [], 0
+            cur_vals.append((key, val))
+            if sanitize_metric_suffix(key) == self.topk_by:
+                rank = val
+        if cur is not None:
+            _flush()
+        for _rank, _seq, st, sub, vals in sorted(heap, reverse=True):
+            for key, val in vals:
+                yield ('sockets', st, sub, key, val)
+
+
+def group_samples(events, naming=DEFAULT_NAMING):
+    """
+    Collect parser events into {(section, metric_name): [(labels, value), ...]}.
+    Consumes the whole event stream before returning, so a failing dump never
+    produces a partial result.
+    """
+    data = {}
+    for section, stack, sub, key, val in events:
+        prefix, _help, _names, label_fn = naming[section]
+        name = prefix + sanitize_metric_suffix(key)
+        data.setdefault((section, name), []).append((label_fn(stack, sub), val))
+    counts = {}
+    for (section, _name), samples in data.items():
+        counts[section] = counts.get(section, 0) + len(samples)
+    SELF_METRICS.samples_emitted(counts)
+    return data
+
+
+def build_families(data, naming=DEFAULT_NAMING):
+    """Yield one CounterMetricFamily per metric in group_samples() output."""
+    from prometheus_client.core import CounterMetricFamily
+    for (section, name), samples in data.items():
+        _prefix, help_text, label_names, _fn = naming[section]
+        fam = CounterMetricFamily(name, help_text, labels=label_names)
+        for labels, val in samples:
+            fam.add_metric(labels, val)
+        yield fam
+
+
+class SnapshotSampler:
+    """
+    Runs build() on its own schedule in a daemon thread and atomically swaps in
+    the returned list of metric families. collect() only serves the latest
+    snapshot plus its age, so scrape latency is constant and the dump rate is
+    independent of how many Prometheus servers scrape us.
+
+    build() returns a list of families (or any payload read via latest()),
+    or None on failure (the previous snapshot is kept and its age keeps growing).
+    """
+
+    def __init__(self, build, interval, name='onload_exporter'):
+        self.build = build
+        self.interval = interval
+        self.name = name
+        self._snapshot = ([], None)   # (families, monotonic time built)
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=f"{self.name}-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while True:
+            t0 = time.monotonic()
+            try:
+                families = self.build()
+            except Exception as e:
+                print(f"Background sample failed: {e}")
+                families = None
+            if families is not None:
+                # single reference assignment: readers see old or new, never a mix
+                self._snapshot = (families, time.monotonic())
+            time.sleep(max(0.0, self.interval - (time.monotonic() - t0)))
+
+    def latest(self):
+        """(payload, age seconds); payload is None and age NaN before the first sample."""
+        payload, built_at = self._snapshot
+        if built_at is None:
+            return None, float('nan')
+        return payload, time.monotonic() - built_at
+
+    def age_family(self, age):
+        from prometheus_client.core import GaugeMetricFamily
+        return GaugeMetricFamily(
+            f"{self.name}_snapshot_age_seconds",
+            "Seconds since the served onload_stackdump snapshot was taken",
+            value=age,
+        )
+
+    def collect(self):
+        families, age = self.latest()
+        yield from families or []
+        yield self.age_family(age)
+
+
+def add_hf_args(parser):
+    """argparse options for HighFreqSampler."""
+    parser.add_argument('--hf-counters', default='',
+                        help='Comma-separated ci_netif_stats counters to poll at high frequency (empty = off)')
+    parser.add_argument('--hf-interval', type=float, default=0.1, help='Seconds between high-frequency polls')
+    parser.add_argument('--hf-window', type=float, default=15.0,
+                        help='Seconds of high-frequency history summarised per scrape (match the scrape interval)')
+
+
+class HighFreqSampler:
+    """
+    Polls selected ci_netif_stats counters every `interval` seconds and keeps a
+    fixed-size ring of (time, value) per series, so bursts shorter than the
+    Prometheus scrape interval stay visible. A counter going backwards is
+    treated as a reset (the new value is the delta since reset).
+
+    collect() summarises the last `window` seconds per series:
+      onload_hf_<counter>_max_rate      max per-second rate between two polls
+      onload_hf_<counter>_max_delta     max increase between two polls
+      onload_hf_<counter>_window_delta  total increase over the window
+      onload_hf_counter_resets_total    resets seen per series
+    """
+
+    LABELS = ['stack_id', 'stack_name', 'pid']
+
+    def __init__(self, source, counters, interval=0.1, window=15.0, name='onload_hf'):
+        self.source = source
+        self.counters = frozenset(sanitize_metric_suffix(c) for c in counters)
+        self.interval = interval
+        self.window = window
+        self.name = name
+        self.maxlen = max(2, int(math.ceil(window / interval)) + 1)
+        self._rings = {}    # (stack_id, stack_name, pid, counter) -> deque[(t, value)]
+        self._resets = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        threading.Thread(target=self._run, name=f"{self.name}-sampler", daemon=True).start()
+        return self
+
+    def _run(self):
+        while True:
+            t0 = time.monotonic()
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"High-frequency poll failed: {e}")
+            time.sleep(max(0.0, self.interval - (time.monotonic() - t0)))
+
+    def poll(self):
+        polled = []
+        for section, st, _sub, key, val in self.source.events():
+            if section != 'ci_netif_stats':
+                continue
+            counter = sanitize_metric_suffix(key)
+            if counter in self.counters:
+                polled.append(((st.stack_id, st.stack_name, st.pid, counter), val))
+        now = time.monotonic()
+        with self._lock:
+            for series, val in polled:
+                ring = self._rings.get(series)
+                if ring is None:
+                    ring = self._rings[series] = deque(maxlen=self.maxlen)
+                elif val < ring[-1][1]:
+                    self._resets[series] = self._resets.get(series, 0) + 1
+                ring.append((now, val))
+            # series not seen for a whole window belong to stacks that went away
+            horizon = now - self.window
+            for series in [s for s, r in self._rings.items() if r[-1][0] < horizon]:
+                del self._rings[series]
+                self._resets.pop(series, None)
+
+    def collect(self):
+        from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily
+        horizon = time.monotonic() - self.window
+        with self._lock:
+            rings = [(series, list(r)) for series, r in self._rings.items()]
+            resets = dict(self._resets)
+
+        by_counter = {}
+        for series, pts in rings:
+            max_rate = max_delta = total = 0
+            for (t0, v0), (t1, v1) in zip(pts, pts[1:]):
+                if t1 < horizon:
+                    continue
+                d = v1 - v0 if v1 >= v0 else v1
+                total += d
+                if d > max_delta:
+                    max_delta = d
+                if t1 > t0 and d / (t1 - t0) > max_rate:
+                    max_rate = d / (t1 - t0)
+            by_counter.setdefault(series[3], []).append((list(series[:3]), max_rate, max_delta, total))
+
+        for counter, rows in by_counter.items():
+            fams = [
+                GaugeMetricFamily(f"{self.name}_{counter}_max_rate",
+                                  f"Max per-second rate of {counter} between polls in the last window",
+                                  labels=self.LABELS),
+                GaugeMetricFamily(f"{self.name}_{counter}_max_delta",
+                                  f"Max increase of {counter} between two polls in the last window",
+                                  labels=self.LABELS),
+                GaugeMetricFamily(f"{self.name}_{counter}_window_delta",
+                                  f"Total increase of {counter} over the last window",
+                                  labels=self.LABELS),
+            ]
+            for labels, max_rate, max_delta, total in rows:
+                fams[0].add_metric(labels, max_rate)
+                fams[1].add_metric(labels, max_delta)
+                fams[2].add_metric(labels, total)
+            yield from fams
+
+        c = CounterMetricFamily(f"{self.name}_counter_resets",
+                                "Counter resets detected by the high-frequency sampler",
+                                labels=self.LABELS + ['counter'])
+        for series, n in resets.items():
+            c.add_metric(list(series), n)
+        yield c
+
+
+class StackdumpCollector:
+    """
+    prometheus_client collector shared by the onload_collector_* exporters.
+
+    source:  StackdumpSource for the main dumps
+    naming:  section -> (prefix, help, label names, labels(stack, sub))
+    reducer: optional events -> events stage (e.g. SocketReducer.reduce)
+
+    collect() dumps inside the scrape unless start_sampler() runs dumps in the
+    background; start_hf_sampler() and start_push() add high-frequency
+    counters and line-protocol push.
+    """
+
+    def __init__(self, source, naming=DEFAULT_NAMING, timeout=1.0, reducer=None):
+        self.source = source
+        self.naming = naming
+        self.timeout = timeout
+        self.reducer = reducer
+        self.sampler = None
+        self.hf = None
+        self.sink = None
+
+    def start_push(self, url, token=None, interval=10.0, max_batches=100, hdr_keys=None):
+        """Also push every background sample as line protocol (needs the background sampler)."""
+        from onload_push import PushSink
+        self.sink = PushSink(url, token, interval, max_batches, hdr_keys).start()
+        return self
+
+    def start_hf_sampler(self, counters, interval, window, stack_filter=None):
+        """Poll the given ci_netif_stats counters every interval seconds in the background."""
+        source = StackdumpSource(('ci_netif_stats',), self.timeout, stack_filter,
+                                 test_file=self.source.test_file, stats_only=True, caller='hf')
+        self.hf = HighFreqSampler(source, counters, interval, window).start()
+        return self
+
+    def start_sampler(self, interval):
+        """Dump in the background every interval seconds; collect() serves the snapshot."""
+        self.sampler = SnapshotSampler(self._sample, interval).start()
+        return self
+
+    def serve(self, port, sample_interval):
+        """Register with prometheus_client (plus SELF_METRICS) and serve on port."""
+        from prometheus_client import start_http_server
+        from prometheus_client.core import REGISTRY
+        if sample_interval > 0:
+            self.start_sampler(sample_interval)
+        REGISTRY.register(self)
+        REGISTRY.register(SELF_METRICS)
+        start_http_server(port)
+
+    def collect(self):
+        if self.hf is not None:
+            yield from self.hf.collect()
+        if self.sampler is not None:
+            yield from self.sampler.collect()
+            return
+        yield from self._sample() or []
+
+    def _sample(self):
+        data = self._sample_data()
+        if data is None:
+            return None
+        if self.sink is not None:
+            self.sink.offer(data, self.naming)
+        return list(build_families(data, self.naming))
+
+    def _sample_data(self):
+        test_file = self.source.test_file
+        if test_file and not os.path.exists(test_file):
+            print(f"Test file {test_file} not found.")
+            return None
+
+        try:
+            events = self.source.events()
+            if self.reducer is not None:
+                events = self.reducer(events)
+            return group_samples(events, self.naming)
+        except subprocess.TimeoutExpired:
+            print('Timeout: onload_stackdump hung')
+        except subprocess.CalledProcessError:
+            print('onload_stackdump failed with non-zero exit')
+        except Exception as e:
+            print(f"General error calling onload_stackdump: {e}")
+        return None
+
+
+def add_collector_args(parser, default_sections='ci_netif_stats'):
+    """argparse options shared by the StackdumpCollector exporters (including stack, hf and push options)."""
+    from onload_push import add_push_args
+    parser.add_argument('--port', type=int, default=9100, help='HTTP port for Prometheus metrics')
+    parser.add_argument('--timeout', type=float, default=1.0, help='Timeout in seconds for onload_stackdump command')
+    parser.add_argument('--sample-interval', type=float, default=5.0,
+                        help='Seconds between background dumps; 0 = dump inside every scrape')
+    parser.add_argument('--sections', default=default_sections,
+                        help='Comma-separated sections to parse (ci_netif_stats,vi,sockets)')
+    add_stack_args(parser)
+    add_hf_args(parser)
+    add_push_args(parser)
+
+
+def start_from_args(collector, args):
+    """
+    Start the push sink and high-frequency sampler requested by the
+    add_collector_args() options; returns the background sample interval
+    to use (push needs the background sampler, so it is never 0 then).
+    """
+    sample_interval = args.sample_interval
+    if args.push_url:
+        collector.start_push(args.push_url, args.push_token or os.environ.get('INFLUX_TOKEN'),
+                             args.push_interval, args.push_queue,
+                             [k.strip() for k in args.hdr_gauges.split(',') if k.strip()] or None)
+        # pushes are fed by the background sampler
+        sample_interval = sample_interval or 5.0
+    hf_counters = [c.strip() for c in args.hf_counters.split(',') if c.strip()]
+    if hf_counters:
+        collector.start_hf_sampler(hf_counters, args.hf_interval, args.hf_window,
+                                   StackFilter(args.stack_include, args.stack_exclude))
+    return sample_interval
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Parser throughput benchmark for the Onload exporters.
+
+Runs each collector's parse path (dump file -> metric families / Gauges) on a
+corpus from onload_stackdump_corpus.py and reports lines/s, samples/s and
+peak Python memory, plus raw parser time per section type.
+
+  python onload_stackdump_bench.py --stacks 24 --sockets 2000
+  python onload_stackdump_bench.py --file saved_dump.txt --repeat 5
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+import onload_collector
+import onload_collector_all
+import onload_collector_v2
+import onload_collector_v3_sockets
+import onload_stackdump_corpus
+from onload_exposition import ExpositionRenderer
+from onload_stackdump import SECTIONS, StackdumpParser, StackdumpSource
+
+
+def _count(families):
+    return sum(len(f.samples) for f in families or [])
+
+
+def _fast_render(collector, renderer):
+    data = collector._sample_data()
+    renderer.render_samples(data, collector.naming)
+    return sum(len(v) for v in data.values())
+
+
+def _collectors(path, sections):
+    """name -> callable running that exporter's parse path once, returning samples produced."""
+    v3 = onload_collector_v3_sockets.OnloadCollector(1.0, sections, test_file=path)
+    renderer = ExpositionRenderer()   # kept across runs, like the exporter's caches
+    return {
+        'onload_collector': lambda: onload_collector.scrape_once(
+            StackdumpSource(sections, None, require_pid=False, test_file=path)),
+        'onload_collector_v2': lambda: _count(
+            onload_collector_v2.OnloadCollector(1.0, sections, test_file=path)._sample()),
+        'onload_collector_v3_sockets': lambda: _count(
+            onload_collector_v3_sockets.OnloadCollector(1.0, sections, test_file=path)._sample()),
+        'onload_collector_v3_sockets+fast': lambda: _fast_render(v3, renderer),
+        'onload_collector_all': lambda: _count(
+            onload_collector_all.OnloadCollector(1.0, sections, test_file=path)._sample()),
+    }
+
+
+def _best_of(fn, repeat):
+    best, result = None, None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return best, result
+
+
+def _peak_mem(fn):
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run(path, sections, repeat):
+    with open(path) as f:
+        lines = f.readlines()
+    n_lines = len(lines)
+    print(f"corpus: {path}  lines={n_lines}  bytes={os.path.getsize(path)}  sections={','.join(sorted(sections))}")
+
+    print(f"\n{'collector':<34} {'time_s':>9} {'lines/s':>12} {'samples':>10} {'samples/s':>12} {'peak_MiB':>9}")
+    for name, fn in _collectors(path, sections).items():
+        dt, samples = _best_of(fn, repeat)
+        peak = _peak_mem(fn)
+        print(f"{name:<34} {dt:9.4f} {n_lines / dt:12.0f} {samples or 0:10d} {(samples or 0) / dt:12.0f} {peak / 2**20:9.2f}")
+
+    # raw parser cost per section (lines already in memory, no metric building)
+    print(f"\n{'section':<34} {'time_s':>9} {'events':>10} {'events/s':>12}")
+    for section in sorted(sections):
+        parser = StackdumpParser((section,))
+        dt, events = _best_of(lambda: sum(1 for _ in parser.parse(lines)), repeat)
+        print(f"{section:<34} {dt:9.4f} {events:10d} {events / dt:12.0f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark Onload exporter parse paths')
+    parser.add_argument('--file', help='Existing dump to benchmark (default: generate a corpus)')
+    parser.add_argument('--stacks', type=int, default=8, help='Generated corpus: number of stacks')
+    parser.add_argument('--sockets', type=int, default=1000, help='Generated corpus: sockets per stack')
+    parser.add_argument('--vis', type=int, default=2, help='Generated corpus: vi sections per stack')
+    parser.add_argument('--sections', default=','.join(SECTIONS), help='Comma-separated sections to parse')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per measurement (best is reported)')
+    args = parser.parse_args()
+
+    sections = set(s.strip() for s in args.sections.split(',') if s.strip())
+    if args.file:
+        run(args.file, sections, args.repeat)
+    else:
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as tmp:
+            for line in onload_stackdump_corpus.generate(args.stacks, args.sockets, args.vis):
+                tmp.write(line + '\n')
+        try:
+            run(tmp.name, sections, args.repeat)
+        finally:
+            os.unlink(tmp.name)
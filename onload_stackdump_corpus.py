@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Synthesize realistic `onload_stackdump lots` output for parser tests and
+benchmarks (see onload_stackdump_bench.py).
+
+  python onload_stackdump_corpus.py --stacks 24 --sockets 2000 --vis 2 -o dump.txt
+"""
+import argparse
+import random
+import sys
+
+NETIF_KEYS = [
+    'evq_cycles', 'evq_polls', 'rx_evs', 'tx_evs', 'rx_discard_csum_bad', 'rx_discard_mcast_mismatch',
+    'rx_discard_crc_bad', 'rx_discard_trunc', 'rx_discard_rights', 'rx_discard_other', 'rx_refill_recv',
+    'reap_rx_limited', 'reap_buf_limited', 'pkts_reaped', 'refill_rx_limited', 'refill_buf_limited',
+    'defer_work_limited', 'tx_dma_max', 'tx_dma_doorbells', 'bufset_alloc_fails', 'nonb_pkt_pool_fails',
+    'muxer_primed', 'pio_pkts', 'no_pio_err', 'ctpio_pkts', 'ctpio_dma_fallbacks', 'sock_wakes_rx',
+    'sock_wakes_tx', 'sock_wakes_rx_os', 'sock_wakes_tx_os', 'sock_wakes_signal', 'pkt_wakes',
+    'unlock_slow', 'lock_wakes', 'stack_lock_buzz', 'deferred_work', 'sock_lock_sleeps', 'sock_lock_buzz',
+    'wait_for_timeouts', 'tcp_send_nonb_pool_empty', 'tcp_rx_ooo', 'rx_overflow', 'udp_rx_drop',
+    'polls', 'fwd_lookup_misses', 'ip_options', 'memory_pressure_enter', 'timewait_reap',
+]
+VI_KEYS = [
+    'rx_pkts', 'tx_pkts', 'rx_bytes', 'tx_bytes', 'rx_dropped', 'evq_overflow',
+    'rxq_level', 'txq_level', 'rx_fill_fails', 'tx_dma_fails',
+]
+TCP_STATES = ['ESTABLISHED', 'LISTEN', 'CLOSE_WAIT', 'TIME_WAIT', 'SYN_SENT']
+
+
+def _socket_block(rng, stack_id, idx):
+    proto = 'TCP' if rng.random() < 0.8 else 'UDP'
+    state = rng.choice(TCP_STATES) if proto == 'TCP' else 'UDP'
+    lcl = f"10.0.{stack_id % 256}.{rng.randint(1, 254)}:{rng.randint(1024, 65535)}"
+    rmt = f"10.1.{rng.randint(0, 255)}.{rng.randint(1, 254)}:{rng.randint(1024, 65535)}" if proto == 'TCP' else '0.0.0.0:0'
+    r = rng.randint
+    lines = [f"{proto} {stack_id}:{idx} lcl={lcl} rmt={rmt} {state}"]
+    lines.append(f"  lock: {r(0, 9)} ({r(0, 9)}) uid=0 s_flags: REUSE")
+    lines.append(f"  rcv: q_len={r(0, 4096)} bytes={r(0, 1 << 20)} tot_bytes={r(0, 1 << 40)} tot_pkts={r(0, 1 << 30)} ooo={r(0, 20)}")
+    if proto == 'TCP':
+        lines.append(f"  snd: q_len={r(0, 4096)} inflight={r(0, 65536)} nxt={hex(r(0, 1 << 32))} una={hex(r(0, 1 << 32))} max={r(0, 1 << 20)}")
+        lines.append(f"  cwnd={r(1, 65536)} ssthresh={r(1, 65536)} rtt={r(1, 1000)}({r(0, 9)}) rto={r(200, 3000)}")
+        lines.append(f"  retrans={r(0, 100)} dupacks={r(0, 50)} zwins={r(0, 5)} rtos={r(0, 5)} state={state}")
+        if state == 'LISTEN':
+            lines.append(f"  listenq: max={r(16, 4096)} n={r(0, 16)}")
+    lines.append(f"  TX timestamping queue: n={r(0, 32)} bytes={r(0, 65536)}")
+    lines.append('  ' + '-' * 40)
+    return lines
+
+
+def generate(stacks=4, sockets=200, vis=2, seed=1):
+    """Yield dump lines (no trailing newline)."""
+    rng = random.Random(seed)
+    for s in range(1, stacks + 1):
+        name = rng.choice(['rx_stack', 'tx_stack', 'md_stack', 'gw_stack', '-'])
+        if name != '-':
+            name = f"{name}{s}"
+        yield '=' * 60
+        yield f"ci_netif_dump_to_logger: stack={s} name={name}"
+        yield f"  Onload 8.1.2.26 uid=0 pid={4000 + s} ns_flags=80"
+        yield "  lock=10000000 UNLOCKED nics=3 primed=3"
+        yield '-' * 20 + f" ci_netif_stats: {s} " + '-' * 20
+        for k in NETIF_KEYS:
+            yield f"  {k}: {rng.randint(0, 1 << 40)}"
+        for v in range(vis):
+            yield f"ci_netif_dump_vi: stack={s} intf={v} dev=0000:0{v + 1}:00.0 hw=0:{v:02x}:{rng.randint(0, 255):02x}"
+            for k in VI_KEYS:
+                yield f"  {k}: {rng.randint(0, 1 << 36)}"
+        yield '-' * 20 + ' sockets ' + '-' * 20
+        for i in range(sockets):
+            yield from _socket_block(rng, s, i)
+        yield '-' * 20 + f" ci_netif_config_opts: {s} " + '-' * 20
+        yield '  EF_POLL_USEC: 100000'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Synthetic onload_stackdump lots output')
+    parser.add_argument('--stacks', type=int, default=4, help='Number of stacks')
+    parser.add_argument('--sockets', type=int, default=200, help='Sockets per stack')
+    parser.add_argument('--vis', type=int, default=2, help='vi sections per stack')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed (output is deterministic per seed)')
+    parser.add_argument('-o', '--output', help='Output file (default stdout)')
+    args = parser.parse_args()
+
+    out = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        for line in generate(args.stacks, args.sockets, args.vis, args.seed):
+            out.write(line + '\n')
+    finally:
+        if out is not sys.stdout:
+            out.close()
@@ -0,0 +1,32 @@
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.openmetrics.parser import text_string_to_metric_families as parse_openmetrics
+from prometheus_client.parser import text_string_to_metric_families as parse_prom
+
+from onload_exposition import ExpositionRenderer
+
+
+def _families():
+    return [
+        GaugeMetricFamily('onload_exporter_snapshot_age_seconds', 'Snapshot age', value=float('nan')),
+        GaugeMetricFamily('onload_test_inf', 'Infinities', labels=['sign']),
+    ]
+
+
+def test_special_values_render_as_exposition_tokens():
+    fams = _families()
+    fams[1].add_metric(['pos'], float('inf'))
+    fams[1].add_metric(['neg'], float('-inf'))
+    text = ExpositionRenderer().render_families(fams)
+    assert 'onload_exporter_snapshot_age_seconds NaN\n' in text
+    assert 'onload_test_inf{sign="pos"} +Inf\n' in text
+    assert 'onload_test_inf{sign="neg"} -Inf\n' in text
+
+
+def test_nan_gauge_parses_in_both_formats():
+    fams = _families()[:1]
+    renderer = ExpositionRenderer()
+    for parse, text in ((parse_prom, renderer.render_families(fams)),
+                        (parse_openmetrics, renderer.render_families(fams, openmetrics=True) + '# EOF\n')):
+        (fam,) = list(parse(text))
+        value = fam.samples[0].value
+        assert value != value